@@ -4,21 +4,30 @@ import json
 import logging
 import os
 import re
+import weakref
 from collections import defaultdict
 from html import escape
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 
 from telegram import Update, InputFile
 from telegram.constants import ParseMode
 from telegram.ext import (
     Application, CommandHandler, MessageHandler, filters,
-    ContextTypes, ConversationHandler
+    ContextTypes, ConversationHandler, BaseUpdateProcessor
 )
 
-from config import BOT_TOKEN, SESSIONS_DIR
-from schedule_filter import generate_filters, apply_filters, apply_filters_to_list
-from schedule_generator import generate_schedules
-from utils import create_user_session, cleanup_user_session
+from config import BOT_TOKEN, SESSIONS_DIR, COUNT_NARROW_HINT, SAMPLE_MIN_COUNT
+from schedule_filter import (
+    generate_filters_async, reset_cursor, next_page, no_match_reasons, load_diagnosis, count_matches, load_count,
+    log_filter_cache_stats
+)
+from generation_service import (
+    get_generation_service, GenerationBusy, GenerationQueueFull, GenerationCancelled
+)
+from utils import create_user_session, cleanup_user_session, remove_subject_file
+from yandex_gpt import get_client
+from session_executor import run_for_user, run_search_for_user, shutdown_executor
+from parallel_search import shutdown_search_pool
 
 # Настройка логирования
 logging.basicConfig(
@@ -30,14 +39,58 @@ logger = logging.getLogger(__name__)
 # Состояния беседы
 UPLOADING, FILTERING, REVIEWING = range(3)
 
+# Команды, которые прерывают генерацию пользователя, а не ждут её конца
+INTERRUPT_COMMANDS = ('/start', '/new', '/cancel')
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Обновления одного пользователя обрабатываются по очереди, разных — параллельно.
+
+    Иначе ConversationHandler получает состояние беседы от того
+    обработчика, что закончил последним, а не от последнего сообщения.
+    Прерывающие команды сначала отменяют генерацию пользователя: ждущий
+    её обработчик /done сразу завершается, и очередь доходит до команды.
+    """
+
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(max_concurrent_updates)
+        # Замок на пользователя живёт, пока его кто-то ждёт или держит
+        self._locks = weakref.WeakValueDictionary()
+
+    async def do_process_update(self, update: object, coroutine) -> None:
+        user = update.effective_user if isinstance(update, Update) else None
+        if user is None:
+            await coroutine
+            return
+
+        message = update.effective_message
+        text = message.text if message is not None and message.text else ''
+        if text.startswith('/') and text.split(maxsplit=1)[0].split('@')[0] in INTERRUPT_COMMANDS:
+            await get_generation_service().cancel(user.id)
+
+        lock = self._locks.get(user.id)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._locks[user.id] = lock
+        async with lock:
+            await coroutine
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Обработчик команды /start - начало работы с ботом."""
     user = update.message.from_user
     logger.info(f"Начало сессии для пользователя {user.id}")
 
-    # Очистка предыдущей сессии
-    cleanup_user_session(user.id)
-    create_user_session(user.id)
+    # Очистка предыдущей сессии: сначала останавливаем её генерацию
+    await get_generation_service().cancel(user.id)
+    await run_for_user(user.id, cleanup_user_session, user.id)
+    await run_for_user(user.id, create_user_session, user.id)
     
     # Сброс данных пользователя
     context.user_data.clear()
@@ -72,8 +125,7 @@ async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         return UPLOADING
 
     # Создание директории
-    input_dir = f"{SESSIONS_DIR}/{user.id}/input_schedules"
-    os.makedirs(input_dir, exist_ok=True)
+    input_dir = await run_for_user(user.id, create_user_session, user.id) + "/input_schedules"
 
     # Скачивание файла
     file = await context.bot.get_file(document.file_id)
@@ -85,29 +137,66 @@ async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         "Можешь отправить следующий файл или нажми /done для завершения загрузки."
     )
 
+    if not await run_for_user(user.id, _validate_json_file, file_path):
+        await update.message.reply_text("❌ Файл повреждён. Отправьте корректный JSON-файл.")
+    return UPLOADING
+
+def _validate_json_file(file_path: str) -> bool:
+    """Проверяет валидность JSON; повреждённый файл удаляется."""
     try:
         with open(file_path, 'r', encoding='utf-8-sig') as f:
-            json.load(f)  # Проверяем валидность JSON
+            json.load(f)
+        return True
     except json.JSONDecodeError:
         os.remove(file_path)
-        await update.message.reply_text("❌ Файл повреждён. Отправьте корректный JSON-файл.")
+        return False
+
+async def remove_subject(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Обработчик /remove <предмет> - удаление загруженного файла предмета."""
+    user = update.message.from_user
+    subject_name = " ".join(context.args).strip()
+    if subject_name.lower().endswith('.json'):
+        subject_name = subject_name[:-5]
+
+    if not subject_name:
+        await update.message.reply_text("ℹ️ Укажи предмет: /remove Название_файла_без_.json")
+    elif await run_for_user(user.id, remove_subject_file, user.id, subject_name):
+        await update.message.reply_text(
+            f"🗑️ Предмет {subject_name} удалён. Нажми /done, чтобы обновить расписания."
+        )
+    else:
+        await update.message.reply_text(f"❌ Файл предмета {subject_name} не найден.")
     return UPLOADING
 
 async def done_uploading(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Обработчик завершения загрузки файлов."""
     user = update.message.from_user
-    await update.message.reply_text("⏳ Начинаю генерацию расписаний... Это может занять несколько минут.")
+    status = await update.message.reply_text("⏳ Начинаю генерацию расписаний... Это может занять несколько минут.")
+
+    async def report_position(position: int) -> None:
+        if position:
+            await status.edit_text(f"⏳ Ты в очереди на генерацию: {position}-й. Подожди немного...")
+        else:
+            await status.edit_text("⏳ Генерирую расписания... Это может занять несколько минут.")
 
     try:
         logger.info(f"Запуск генерации расписаний для {user.id}")
         await update.message.reply_chat_action(action="typing")
 
-        # Запускаем генерацию с таймаутом
+        # Генерация идёт в отдельном процессе, таймаут считается с её начала
         try:
-            count = await asyncio.wait_for(
-                asyncio.to_thread(generate_schedules, user.id),
-                timeout=300  # 5 минут таймаут
+            found = await get_generation_service().run(user.id, notify=report_position)
+        except GenerationBusy:
+            await update.message.reply_text("⏳ Генерация уже идёт. Дождись результата.")
+            return UPLOADING
+        except GenerationQueueFull:
+            await update.message.reply_text(
+                "😔 Сейчас слишком много желающих. Попробуй нажать /done через пару минут."
             )
+            return UPLOADING
+        except GenerationCancelled:
+            # Отменившая генерацию команда сама задаёт состояние беседы
+            return None
         except asyncio.TimeoutError:
             await update.message.reply_text(
                 "⏱️ Генерация заняла слишком много времени. "
@@ -115,7 +204,15 @@ async def done_uploading(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             )
             return ConversationHandler.END
 
-        if count == 0:
+        if not found:
+            reasons = await run_for_user(user.id, load_diagnosis, user.id)
+            if reasons:
+                await update.message.reply_text(
+                    "😢 Из загруженных предметов не складывается ни одного расписания:\n"
+                    + "\n".join(reasons)
+                    + "\n\nЗамени или удали (/remove) мешающий файл и снова нажми /done"
+                )
+                return UPLOADING
             await update.message.reply_text(
                 "😢 Не удалось сгенерировать ни одного расписания. Возможные причины:\n"
                 "• Нет файлов в папке или они повреждены\n"
@@ -125,9 +222,11 @@ async def done_uploading(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             )
             return ConversationHandler.END
 
+        total = await run_for_user(user.id, load_count, user.id)
         await update.message.reply_text(
-            f"🎉 Успешно сгенерировано {count} расписаний!\n\n"
-            "📝 Теперь расскажи, какое расписание ты хочешь?\n"
+            "🎉 Расписания успешно сгенерированы!\n"
+            + (f"Всего вариантов: {_format_count(total)}\n" if total is not None else "")
+            + "\n📝 Теперь расскажи, какое расписание ты хочешь?\n"
             "Примеры запросов:\n"
             "• 'Не хочу пар в понедельник'\n"
             "• 'Пары только до 16 часов'\n"
@@ -165,7 +264,7 @@ async def handle_preferences(update: Update, context: ContextTypes.DEFAULT_TYPE)
             context.user_data['original_query'] = user_input
 
         # Генерируем фильтры
-        filters_data = generate_filters(full_query)
+        filters_data = await generate_filters_async(full_query)
         
         # Для корректировки объединяем с предыдущими фильтрами
         if is_adjustment or is_exclusion:
@@ -184,6 +283,11 @@ async def handle_preferences(update: Update, context: ContextTypes.DEFAULT_TYPE)
                 if not isinstance(value, (list, dict)):
                     merged_filters[key] = value
             
+            # Словари (в том числе веса мягких фильтров) дополняем новыми значениями
+            for key in set(prev_filters.keys()) | set(filters_data.keys()):
+                if isinstance(prev_filters.get(key), dict) or isinstance(filters_data.get(key), dict):
+                    merged_filters[key] = {**(prev_filters.get(key) or {}), **(filters_data.get(key) or {})}
+            
             # Обрабатываем списки
             for key in set(prev_filters.keys()) | set(filters_data.keys()):
                 merged_list = []
@@ -228,35 +332,38 @@ async def handle_preferences(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
         # Применяем фильтры
         if is_adjustment or is_exclusion:
-            # Берем предыдущий отфильтрованный набор
-            previous_matched = context.user_data.get('matched_schedules', [])
-            matched_count = apply_filters_to_list(
-                user.id, 
-                filters_data, 
-                previous_matched
-            )
+            # Уточнение сужает предыдущий результат: прежние фильтры остаются в цепочке
+            filters_chain = context.user_data.get('filters_chain', []) + [filters_data]
         else:
             # При первом запросе применяем ко всем расписаниям
-            matched_count = apply_filters(user.id, filters_data)
-        
-        # Получаем matched_schedules
-        matched_schedules = _get_matched_schedules(user.id)
+            filters_chain = [filters_data]
+        await run_for_user(user.id, reset_cursor, user.id, filters_chain)
         
-        # Сохраняем данные для пагинации и корректировки
-        context.user_data['matched_schedules'] = matched_schedules
-        context.user_data['total_count'] = matched_count
+        # Сохраняем данные для корректировки
+        context.user_data['filters_chain'] = filters_chain
         context.user_data['current_filters'] = filters_data
-        context.user_data['shown_index'] = 0  # Сбрасываем индекс показа
         
         # Показываем первые 3 расписания
-        await _send_schedules_message(
-            update=update,
-            context=context,
-            schedules=matched_schedules,
-            start_index=0,
-            limit=3,
-            total_count=matched_count
-        )
+        await _send_next_page(update, context)
+
+        # Сколько всего вариантов и сколько из них подходит под пожелания
+        total, matched, exact = await run_search_for_user(user.id, count_matches, user.id)
+        if matched:
+            summary = f"📊 Под пожелания подходит {'' if exact else 'не больше '}{_format_count(matched)}"
+            if total is not None:
+                summary += f" из {_format_count(total)} вариантов"
+            if matched > COUNT_NARROW_HINT:
+                summary += ". Их слишком много — уточни пожелания, чтобы выбрать из лучших"
+            if matched >= SAMPLE_MIN_COUNT:
+                summary += ". После лучших покажу случайные варианты из всех подходящих"
+            await update.message.reply_text(summary)
+        
+        # Если точных совпадений нет, объясняем почему
+        reasons = await run_for_user(user.id, no_match_reasons, user.id)
+        if reasons:
+            await update.message.reply_text(
+                "🔎 Почему нет точных совпадений:\n" + "\n".join(reasons)
+            )
         
         # Переходим в состояние просмотра результатов
         return REVIEWING
@@ -267,34 +374,52 @@ async def handle_preferences(update: Update, context: ContextTypes.DEFAULT_TYPE)
         return FILTERING
 
 
-def _get_matched_schedules(user_id: int) -> List[dict]:
-    """Получает отфильтрованные расписания из файла."""
-    matched_file = f"{SESSIONS_DIR}/{user_id}/matched_schedules.json"
-    
-    try:
-        with open(matched_file, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-            return data.get("matched_schedules", [])
-    except Exception as e:
-        logger.error(f"Ошибка чтения файла расписаний: {e}")
-        return []
+async def _send_next_page(update: Update, context: ContextTypes.DEFAULT_TYPE) -> bool:
+    """Достаёт из генератора следующую страницу расписаний и отправляет её.
+
+    Возвращает False, если показывать больше нечего.
+    """
+    user = update.message.from_user
+
+    page, shown, exhausted = await run_search_for_user(user.id, next_page, user.id, 3)
+    context.user_data['exhausted'] = exhausted
+
+    if not page and shown > 0:
+        return False
+
+    await _send_schedules_message(
+        update=update,
+        context=context,
+        schedules=page,
+        start_index=shown - len(page),
+        total_count=shown if exhausted else None
+    )
+    return True
 
 async def _send_schedules_message(
     update: Update,
     context: ContextTypes.DEFAULT_TYPE,
     schedules: List[dict],
-    total_count: int,
-    start_index: int = 0,
-    limit: int = 3
+    total_count: Optional[int],
+    start_index: int = 0
 ) -> None:
-    """Функция отправки расписаний с пагинацией."""
+    """Функция отправки страницы расписаний, начинающейся с start_index.
+
+    total_count — None, пока перебор не дошёл до конца и общее число неизвестно.
+    """
     try:
         # Рассчитываем индексы для отображения
-        end_index = min(start_index + limit, len(schedules))
+        end_index = start_index + len(schedules)
         
         # Формируем заголовок с информацией о пагинации
+        if total_count is None:
+            found = f"🎯 Найдены варианты (показаны {start_index+1}-{end_index})"
+        else:
+            found = f"🎯 Найдено {total_count} вариантов (показаны {start_index+1}-{end_index})"
+        if any(schedule.get("нарушено") for schedule in schedules):
+            found += ". Не все пожелания выполнимы — сначала самые близкие к ним"
         header = (
-            f"<b>🎯 Найдено {total_count} вариантов (показаны {start_index+1}-{end_index}):</b>\n\n"
+            f"<b>{found}:</b>\n\n"
             "Формат каждого расписания:\n"
             "1. <b>Предмет</b> (группа)\n"
             "2. <b>Преподаватели</b>\n"
@@ -304,7 +429,7 @@ async def _send_schedules_message(
         await update.message.reply_text(header, parse_mode=ParseMode.HTML)
 
         # Обрабатываем запрошенный диапазон расписаний
-        for i, schedule in enumerate(schedules[start_index:end_index], start_index+1):
+        for i, schedule in enumerate(schedules, start_index+1):
             try:
                 subjects = defaultdict(lambda: {'groups': set(), 'teachers': set()})
                 days = defaultdict(list)
@@ -360,6 +485,12 @@ async def _send_schedules_message(
                         for lesson in sorted(days[day]):
                             message.append(f"   ‣ {lesson}")
 
+                # Невыполненные мягкие пожелания
+                if schedule.get("нарушено"):
+                    message.append("\n<b>⚠️ Не выполнено:</b>")
+                    for violation in schedule["нарушено"]:
+                        message.append(f"• {violation}")
+
                 # Отправляем сообщение
                 full_msg = "\n".join(message)
                 if len(full_msg) > 4000:
@@ -372,9 +503,6 @@ async def _send_schedules_message(
                 logger.error(f"Ошибка обработки расписания #{i}: {e}")
                 continue
 
-        # Обновляем индекс последнего показанного
-        context.user_data['shown_index'] = end_index
-        
         # Финальное сообщение с опциями
         footer = (
             "━━━━━━━━━━━━━━━━━━━━━━━━━\n"
@@ -393,6 +521,10 @@ async def _send_schedules_message(
             parse_mode=ParseMode.HTML
         )
 
+def _format_count(count: int) -> str:
+    """Число с разбивкой на разряды: 2 300 000"""
+    return f"{count:,}".replace(",", "\u202f")
+
 def clean_text(text: str) -> str:
     """Очистка текста от спецсимволов."""
     if not text:
@@ -431,28 +563,11 @@ def extract_english_group(group: str) -> str:
 
 async def next_schedules(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Показать следующие расписания"""
-    user = update.message.from_user
-    user_data = context.user_data
-    
-    shown_index = user_data.get('shown_index', 0)
-    matched_schedules = user_data.get('matched_schedules', [])
-    total_count = user_data.get('total_count', 0)
-    
-    # Проверяем, есть ли еще расписания
-    if shown_index >= len(matched_schedules):
+    # Проверяем, есть ли еще расписания, и показываем следующие 3
+    if context.user_data.get('exhausted', True) or not await _send_next_page(update, context):
         await update.message.reply_text("ℹ️ Больше нет доступных расписаний.")
         return REVIEWING
     
-    # Показываем следующие 3 расписания
-    await _send_schedules_message(
-        update=update,
-        context=context,
-        schedules=matched_schedules,
-        start_index=shown_index,
-        limit=3,
-        total_count=total_count
-    )
-    
     return REVIEWING
 
 async def adjust_query(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
@@ -483,7 +598,8 @@ async def new_search(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Обработчик команды отмены."""
     user = update.message.from_user
-    cleanup_user_session(user.id)
+    await get_generation_service().cancel(user.id)
+    await run_for_user(user.id, cleanup_user_session, user.id)
     context.user_data.clear()
     await update.message.reply_text("🗑️ Сессия завершена. Начни заново с /start.")
     return ConversationHandler.END
@@ -505,24 +621,45 @@ async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE):
         msg = "⚠️ Произошла ошибка обработки фильтров. Попробуйте другой запрос."
         await update.message.reply_text(msg)
 
+async def on_shutdown(application: Application) -> None:
+    """Останавливает генерации и освобождает пулы соединений и файловых операций."""
+    await get_generation_service().close()
+    await get_client().close()
+    shutdown_executor()
+    shutdown_search_pool()
+    log_filter_cache_stats()
+
 def main():
     """Основная функция запуска бота."""
     # Создаем папку сессий, если не существует
     os.makedirs(SESSIONS_DIR, exist_ok=True)
 
-    application = Application.builder().token(BOT_TOKEN).build()
+    application = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        # Долгие обработчики одного пользователя не должны задерживать остальных
+        .concurrent_updates(PerUserUpdateProcessor(256))
+        .post_shutdown(on_shutdown)
+        .build()
+    )
 
     conv_handler = ConversationHandler(
         entry_points=[CommandHandler('start', start)],
         states={
             UPLOADING: [
                 MessageHandler(filters.Document.ALL, handle_document),
-                CommandHandler('done', done_uploading)
+                CommandHandler('done', done_uploading),
+                CommandHandler('remove', remove_subject)
             ],
             FILTERING: [
-                MessageHandler(filters.TEXT & ~filters.COMMAND, handle_preferences)
+                MessageHandler(filters.TEXT & ~filters.COMMAND, handle_preferences),
+                # Файлы можно менять и после генерации: /done пересчитает только изменённое
+                MessageHandler(filters.Document.ALL, handle_document),
+                CommandHandler('remove', remove_subject)
             ],
             REVIEWING: [
+                MessageHandler(filters.Document.ALL, handle_document),
+                CommandHandler('remove', remove_subject),
                 CommandHandler('next', next_schedules),
                 CommandHandler('adjust', adjust_query),
                 CommandHandler('exclude', exclude_group),
@@ -530,7 +667,9 @@ def main():
                 CommandHandler('cancel', cancel)
             ]
         },
-        fallbacks=[CommandHandler('cancel', cancel)]
+        fallbacks=[CommandHandler('cancel', cancel)],
+        # /start посреди беседы начинает её заново
+        allow_reentry=True
     )
 
     application.add_handler(conv_handler)
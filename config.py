@@ -9,7 +9,57 @@ BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN", "")
 # Yandex GPT
 YANDEX_GPT_API_KEY = os.getenv("YANDEX_GPT_API_KEY", "")
 YANDEX_GPT_URL = "https://llm.api.cloud.yandex.net/foundationModels/v1/completion"
+YANDEX_GPT_TIMEOUT = 15  # общий бюджет на запрос с повторами, с
+YANDEX_GPT_MAX_CONCURRENCY = 8
+YANDEX_GPT_RETRIES = 2
 
 # Пути
 SESSIONS_DIR = "sessions"
-MAX_SCHEDULES = 10000  # Уменьшено для безопасности
\ No newline at end of file
+
+# Общий бюджет процессов на вычисления. Поиск по шардам идёт внутри процессов
+# генерации и вычислений сессии, поэтому внешние пулы делят бюджет на SEARCH_WORKERS
+CPU_BUDGET = os.cpu_count() or 1
+# Процессы пула шардов у одного поиска
+SEARCH_WORKERS = min(4, CPU_BUDGET)
+PARALLEL_MIN_SUBJECTS = 12
+
+# Потоки для блокирующих операций с файлами сессий
+SESSION_IO_WORKERS = 4
+# Процессы для вычислений над сессией: поиск лучших, подсчёт, выборка
+SESSION_SEARCH_WORKERS = max(1, CPU_BUDGET // SEARCH_WORKERS)
+
+# Генерация расписаний в отдельных процессах
+GENERATION_WORKERS = max(1, CPU_BUDGET // SEARCH_WORKERS)
+GENERATION_QUEUE_SIZE = 50
+GENERATION_TIMEOUT = 300  # с, считая с начала генерации
+GENERATION_EXIT_GRACE = 5  # с на завершение процесса генерации после отправки результата
+
+# Ранжированная выдача: сколько лучших расписаний показывается первыми
+RANKED_TOP_K = 30
+RANKED_SEARCH_NODES = 200000  # узлов перебора, после которых берётся лучшее из найденного
+
+# Поиск причины, по которой нет ни одного расписания
+DIAGNOSIS_TIMEOUT = 0.5  # с
+
+# Точный подсчёт расписаний без их перебора
+COUNT_NODES = 200000  # узлов дерева поиска, после которых подсчёт прекращается
+COUNT_ENUMERATION_LIMIT = 20000  # до стольких комбинаций проверки целых расписаний считаются перебором
+COUNT_NARROW_HINT = 1000  # больше стольких подходящих — советуем уточнить пожелания
+
+# Равномерная случайная выборка вместо перебора по порядку для огромного числа подходящих
+SAMPLE_MIN_COUNT = 100000
+SAMPLE_BATCH = 30  # расписаний выборки, которые тянутся за раз и ждут своей страницы в курсоре
+SAMPLE_DRAWS = 10000  # номеров комбинаций, которые тянутся за одну порцию выборки
+
+# Кэш фильтров Yandex GPT
+FILTER_CACHE_PATH = "cache/filter_cache.json"
+FILTER_CACHE_SIZE = 1000
+FILTER_CACHE_TTL = 7 * 24 * 3600  # с
+
+# Общий для всех пользователей кэш разобранных файлов предметов
+PARSED_CACHE_DIR = "cache/parsed"
+PARSED_CACHE_MAX_BYTES = 200 * 1024 * 1024
+
+# Хранилище готовых результатов генерации
+RESULTS_DIR = "cache/results"
+RESULTS_MAX_ENTRIES = 500
\ No newline at end of file
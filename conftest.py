@@ -0,0 +1,71 @@
+import random
+import itertools
+
+import pytest
+
+from schedule_model import Catalog, Lesson, Team
+
+DAYS = ['понедельник', 'вторник', 'среда']
+TEACHERS = ['Иванов', 'Петров', 'Сидоров']
+
+
+def _random_session(seed, subjects, teams):
+    """Случайная сессия: каталог и индекс совместимости групп, как у schedule_generator"""
+    rnd = random.Random(seed)
+    catalog_teams = []
+    for subject in range(subjects):
+        subject_teams = []
+        for team in range(teams):
+            slots = rnd.sample([(day, slot) for day in range(len(DAYS)) for slot in range(4)], rnd.randint(1, 3))
+            lessons = [
+                Lesson("Лекция", DAYS[day], day, 480 + 100 * slot, 570 + 100 * slot, [rnd.choice(TEACHERS)], "")
+                for day, slot in slots
+            ]
+            subject_teams.append(Team(f"Предмет{subject}", f"АТ-{team:02d}", lessons))
+        catalog_teams.append(subject_teams)
+    catalog = Catalog([f"Предмет{subject}" for subject in range(subjects)], catalog_teams)
+
+    def overlap(team_a, team_b):
+        return any(
+            a.day == b.day and a.start < b.end and b.start < a.end
+            for a in team_a.lessons for b in team_b.lessons
+        )
+
+    compatible = [[[0] * subjects for _ in range(teams)] for _ in range(subjects)]
+    for i, j in itertools.permutations(range(subjects), 2):
+        for a, team_a in enumerate(catalog_teams[i]):
+            for b, team_b in enumerate(catalog_teams[j]):
+                if not overlap(team_a, team_b):
+                    compatible[i][a][j] |= 1 << b
+    index = {
+        "subjects": list(catalog.subjects),
+        "teams": [[team.name for team in subject_teams] for subject_teams in catalog_teams],
+        "compatible": compatible
+    }
+    return index, catalog
+
+
+def _all_assignments(index, domains=None):
+    """Все валидные комбинации групп прямым перебором декартова произведения"""
+    compatible = index["compatible"]
+    choices = [
+        [team for team in range(len(names)) if domains is None or domains[subject] >> team & 1]
+        for subject, names in enumerate(index["teams"])
+    ]
+    return [
+        combo for combo in itertools.product(*choices)
+        if all(
+            compatible[i][combo[i]][j] >> combo[j] & 1
+            for i in range(len(combo)) for j in range(i + 1, len(combo))
+        )
+    ]
+
+
+@pytest.fixture
+def random_session():
+    return _random_session
+
+
+@pytest.fixture
+def all_assignments():
+    return _all_assignments
@@ -0,0 +1,258 @@
+import time
+import logging
+
+from config import DIAGNOSIS_TIMEOUT
+from filter_plan import compile_filters, hard_filters, describe_filter
+from lesson_ingest import format_minutes
+
+logger = logging.getLogger(__name__)
+
+# Как часто (в узлах перебора) проверяется, не вышло ли время диагностики
+DEADLINE_CHECK_EVERY = 256
+
+
+class _Timeout(Exception):
+    """Время на диагностику вышло"""
+
+
+def diagnose_schedules(index, catalog, timeout=DIAGNOSIS_TIMEOUT):
+    """Объясняет, почему из загруженных предметов не складывается ни одно расписание.
+
+    Ищет минимальный набор предметов, которые нельзя совместить: из
+    набора по очереди выбрасываются предметы, пока без них расписаний
+    всё ещё нет. Проверки идут по таблице совместимости групп без
+    перебора готовых расписаний и ограничены timeout секунд; если время
+    вышло, набор может оказаться не минимальным. Возвращает строки
+    объяснения.
+    """
+    deadline = time.monotonic() + timeout
+    domains = [(1 << len(teams)) - 1 for teams in index["teams"]]
+    empty = [subject for subject, domain in enumerate(domains) if not domain]
+    if empty:
+        return [
+            f"У предмета «{index['subjects'][subject]}» нет ни одной группы без пересечений внутри себя"
+            for subject in empty
+        ]
+    try:
+        conflict = _minimal_conflict(index, domains, deadline)
+    except _Timeout:
+        return ["Не удалось быстро найти причину: слишком много сочетаний групп"]
+    if conflict is None:
+        return []
+    return _explain_conflict(index, catalog, domains, conflict)
+
+
+def diagnose_filters(index, catalog, filters_chain, timeout=DIAGNOSIS_TIMEOUT, known_empty=True):
+    """Объясняет, почему ни одно расписание не проходит цепочку фильтров.
+
+    Сначала ищутся предметы, у которых фильтры исключили все группы, и
+    фильтры, каждый из которых делает это в одиночку. Затем — минимальный
+    набор предметов, которые с оставшимися группами нельзя совместить.
+    Если группы совместимы, а мешают проверки целых расписаний (окна,
+    число пар в день и т.п.), ищется минимальный набор таких фильтров,
+    которые вместе не выполняются ни в одном расписании. known_empty —
+    уже известно, что подходящих расписаний нет; иначе (поиск подходящих
+    остановился, ничего не найдя) это проверяется перебором, и если
+    подходящее нашлось, возвращается пустой список.
+    """
+    if any(not filters for filters in filters_chain):
+        return ["Пустой набор фильтров не пропускает ни одного расписания"]
+
+    deadline = time.monotonic() + timeout
+    plan = compile_filters(catalog, filters_chain)
+    domains = [domain & ((1 << len(teams)) - 1) for domain, teams in zip(plan["domains"], index["teams"])]
+    named = [
+        (key, filters[key])
+        for filters in filters_chain
+        for key in hard_filters(filters)
+    ]
+
+    # Предметы без единой группы, сгруппированные по виноватым фильтрам
+    excluded = {}
+    single = [compile_filters(catalog, [{key: value}])["domains"] for key, value in named]
+    for subject, domain in enumerate(domains):
+        if not domain:
+            culprits = tuple(
+                describe_filter(*item) for item, item_domains in zip(named, single) if not item_domains[subject]
+            )
+            excluded.setdefault(culprits, []).append(f"«{index['subjects'][subject]}»")
+    if excluded:
+        return [
+            f"Фильтры исключают все группы {', '.join(subjects)}"
+            + (f": {'; '.join(culprits)}" if culprits else " только в сочетании")
+            for culprits, subjects in excluded.items()
+        ]
+
+    try:
+        conflict = _minimal_conflict(index, domains, deadline)
+    except _Timeout:
+        return ["Не удалось быстро найти причину: попробуй ослабить пожелания"]
+    if conflict is not None:
+        return ["С учётом фильтров:"] + _explain_conflict(index, catalog, domains, conflict)
+
+    try:
+        culprits = _minimal_filters(index, catalog, named, deadline, known_empty)
+    except _Timeout:
+        return ["Не удалось быстро найти причину: попробуй ослабить пожелания"]
+    if culprits is None:
+        return []
+    if len(culprits) == 1:
+        return [f"Ни одно расписание не выполняет пожелание «{describe_filter(*culprits[0])}»"]
+    return ["Вместе не выполняются пожелания: " + "; ".join(f"«{describe_filter(*item)}»" for item in culprits)]
+
+
+def _minimal_conflict(index, domains, deadline):
+    """Минимальный по включению набор предметов без совместного расписания или None"""
+    subjects = list(range(len(domains)))
+    clock = _Clock(deadline)
+    if _feasible(index["compatible"], domains, subjects, clock):
+        return None
+
+    # Предметы с наибольшим числом групп реже виноваты: их пробуем выбросить первыми
+    for subject in sorted(subjects, key=lambda i: -domains[i].bit_count()):
+        rest = [i for i in subjects if i != subject]
+        try:
+            if not _feasible(index["compatible"], domains, rest, clock):
+                subjects = rest
+        except _Timeout:
+            break
+    return subjects
+
+
+def _feasible(compatible, domains, subjects, clock):
+    """Есть ли совместимые группы для всех subjects: поиск с MRV и отсечением, как в iter_assignments"""
+
+    def search(domains, unassigned):
+        clock.tick()
+        if not unassigned:
+            return True
+        current = min(unassigned, key=lambda i: domains[i].bit_count())
+        rest = [i for i in unassigned if i != current]
+        domain = domains[current]
+        while domain:
+            lowest = domain & -domain
+            domain ^= lowest
+            row = compatible[current][lowest.bit_length() - 1]
+            narrowed = list(domains)
+            for other in rest:
+                narrowed[other] &= row[other]
+                if not narrowed[other]:
+                    break
+            else:
+                if search(narrowed, rest):
+                    return True
+        return False
+
+    return search(list(domains), list(subjects))
+
+
+def _minimal_filters(index, catalog, named, deadline, known_empty=True):
+    """Минимальный набор фильтров, который вместе не пропускает ни одного расписания; None, если такого нет"""
+    from schedule_generator import iter_assignments
+
+    clock = _Clock(deadline)
+
+    def matches_nothing(items):
+        plan = compile_filters(catalog, [{key: value} for key, value in items])
+        for team_indices in iter_assignments(index, None, plan["domains"]):
+            clock.tick()
+            if all(check(team_indices) for check in plan["checks"]):
+                return False
+        return True
+
+    if not known_empty and not matches_nothing(named):
+        return None
+
+    # Чаще всего невыполнимо одно пожелание: расписание под любое другое находится быстро
+    for item in named:
+        if matches_nothing([item]):
+            return [item]
+
+    culprits = list(named)
+    for item in list(culprits):
+        rest = [other for other in culprits if other is not item]
+        try:
+            if matches_nothing(rest):
+                culprits = rest
+        except _Timeout:
+            logger.info("Диагностика фильтров остановлена по времени")
+            break
+    return culprits
+
+
+def _explain_conflict(index, catalog, domains, subjects):
+    """Строки объяснения для набора предметов, которые нельзя совместить"""
+    names = index["subjects"]
+    if len(subjects) == 1:
+        return [f"У «{names[subjects[0]]}» не осталось ни одной группы"]
+
+    compatible = index["compatible"]
+    lines = []
+    if len(subjects) == 2:
+        first, second = subjects
+        # Если у одного из предметов одна группа, виновата именно она
+        if domains[first].bit_count() == 1:
+            first, second = second, first
+        if domains[second].bit_count() == 1:
+            team = domains[second].bit_length() - 1
+            example = _first_team(domains[first])
+            lines.append(
+                f"Все группы «{names[first]}» пересекаются с «{names[second]}» "
+                f"{catalog.teams[second][team].name}"
+                + _collision(catalog, first, example, second, team)
+            )
+        else:
+            example_a, example_b = _first_team(domains[first]), _first_team(domains[second])
+            lines.append(
+                f"Каждая группа «{names[first]}» пересекается с каждой группой «{names[second]}», "
+                f"например {catalog.teams[first][example_a].name} и {catalog.teams[second][example_b].name}"
+                + _collision(catalog, first, example_a, second, example_b)
+            )
+        return lines
+
+    lines.append("Эти предметы нельзя совместить: " + ", ".join(f"«{names[i]}»" for i in subjects))
+    for position, first in enumerate(subjects):
+        for second in subjects[position + 1:]:
+            pairs = sum(
+                (compatible[first][team][second] & domains[second]).bit_count()
+                for team in _teams_of(domains[first])
+            )
+            total = domains[first].bit_count() * domains[second].bit_count()
+            lines.append(f"• «{names[first]}» и «{names[second]}»: совместимы {pairs} из {total} пар групп")
+    return lines
+
+
+def _collision(catalog, first, team_a, second, team_b):
+    """Текст «: вторник 10:00» с первым пересечением двух групп"""
+    for lesson_a in catalog.teams[first][team_a].lessons:
+        for lesson_b in catalog.teams[second][team_b].lessons:
+            if lesson_a.start is None or lesson_b.start is None or lesson_a.day != lesson_b.day:
+                continue
+            if lesson_a.start < lesson_b.end and lesson_b.start < lesson_a.end:
+                start = max(lesson_a.start, lesson_b.start)
+                return f" (например, {lesson_a.day} {format_minutes(start)})"
+    return ""
+
+
+def _first_team(domain):
+    return (domain & -domain).bit_length() - 1
+
+
+def _teams_of(domain):
+    while domain:
+        lowest = domain & -domain
+        domain ^= lowest
+        yield lowest.bit_length() - 1
+
+
+class _Clock:
+    """Считает узлы перебора и прерывает его, когда выходит время"""
+
+    def __init__(self, deadline):
+        self.deadline = deadline
+        self.nodes = 0
+
+    def tick(self):
+        self.nodes += 1
+        if self.nodes % DEADLINE_CHECK_EVERY == 0 and time.monotonic() > self.deadline:
+            raise _Timeout()
@@ -0,0 +1,104 @@
+import os
+import re
+import copy
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+from schedule_store import write_json, load_json
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_query(text):
+    """Приводит запрос к ключу кэша: регистр, ё, пунктуация и пробелы"""
+    text = text.lower().replace('ё', 'е')
+    text = re.sub(r'[^\w:]+', ' ', text)
+    return ' '.join(text.split())
+
+
+class FilterCache:
+    """Персистентный кэш фильтров, полученных от Yandex GPT.
+
+    Ключ — нормализованный текст запроса. Записи вытесняются по LRU
+    при превышении max_entries и устаревают через ttl секунд. version
+    задаёт промпт, под который построены фильтры: при его смене кэш
+    сбрасывается целиком.
+    """
+
+    def __init__(self, path, version, max_entries=1000, ttl=7 * 24 * 3600):
+        self.path = path
+        self.version = version
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = None
+        self._lock = threading.Lock()
+
+    def get(self, text):
+        """Возвращает копию фильтров для запроса или None"""
+        key = normalize_query(text)
+        with self._lock:
+            entries = self._load()
+            entry = entries.get(key)
+            if entry is not None and time.time() - entry["time"] > self.ttl:
+                del entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            entries.move_to_end(key)
+            self.hits += 1
+            return copy.deepcopy(entry["filters"])
+
+    def put(self, text, filters):
+        """Сохраняет фильтры запроса и сбрасывает кэш на диск"""
+        key = normalize_query(text)
+        with self._lock:
+            entries = self._load()
+            entries[key] = {"time": time.time(), "filters": copy.deepcopy(filters)}
+            entries.move_to_end(key)
+            while len(entries) > self.max_entries:
+                entries.popitem(last=False)
+            self._save()
+
+    def stats(self):
+        """Счётчики попаданий и промахов с момента запуска"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "size": len(self._load())
+            }
+
+    def _load(self):
+        if self._entries is not None:
+            return self._entries
+
+        self._entries = OrderedDict()
+        try:
+            data = load_json(self.path, default={})
+            if data.get("version") == self.version:
+                # Файл хранит записи от давних к свежим
+                self._entries.update(data.get("entries", []))
+            elif data:
+                logger.info("Промпт изменился, кэш фильтров сброшен")
+        except Exception as e:
+            logger.error(f"Ошибка чтения кэша фильтров {self.path}: {e}")
+        return self._entries
+
+    def _save(self):
+        try:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            write_json(self.path, {
+                "version": self.version,
+                "entries": list(self._entries.items())
+            })
+        except Exception as e:
+            logger.error(f"Ошибка сохранения кэша фильтров {self.path}: {e}")
@@ -0,0 +1,451 @@
+import re
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Ниже этой уверенности запрос отдаётся Yandex GPT
+CONFIDENCE_THRESHOLD = 0.8
+
+ALL_DAYS = ['понедельник', 'вторник', 'среда', 'четверг', 'пятница', 'суббота', 'воскресенье']
+
+DAY_PATTERNS = [
+    (re.compile(r'понедельник\w*|пн'), 'понедельник'),
+    (re.compile(r'вторник\w*|вт'), 'вторник'),
+    (re.compile(r'сред[аыуе]|средам\w*|ср'), 'среда'),
+    (re.compile(r'четверг\w*|чт'), 'четверг'),
+    (re.compile(r'пятниц\w*|пт'), 'пятница'),
+    (re.compile(r'суббот\w*|сб'), 'суббота'),
+    (re.compile(r'воскресень\w*|вс'), 'воскресенье'),
+]
+
+NUMBER_WORDS = {
+    'один': 1, 'одна': 1, 'одну': 1, 'одной': 1, 'одного': 1,
+    'два': 2, 'две': 2, 'двух': 2,
+    'три': 3, 'трех': 3,
+    'четыре': 4, 'четырех': 4,
+    'пять': 5, 'пяти': 5,
+    'шесть': 6, 'шести': 6,
+}
+
+# Маркеры полярности: отрицание исключает, ограничение оставляет только упомянутое
+NEGATIVE_WORDS = {'не', 'нет', 'без', 'кроме', 'никаких', 'ни'}
+NEGATIVE_STEMS = ('выходн', 'свободн', 'исключ')
+POSITIVE_WORDS = {'только', 'лишь', 'исключительно'}
+
+# Маркеры мягкого пожелания: «желательно без окон», «по возможности не в пятницу»
+SOFT_WORDS = {'желательно', 'предпочтительно', 'возможности', 'лучше', 'необязательно', 'получится', 'если'}
+
+# Границы, дальше которых маркер не действует
+CLAUSE_BREAKS = {'.', ';', '!', '?', ',', 'а', 'но', 'однако'}
+
+# Слова без собственного смысла для фильтров
+STOP_WORDS = {
+    'хочу', 'хотел', 'хотела', 'хотелось', 'хотим', 'хочется', 'бы', 'чтобы', 'чтоб',
+    'мне', 'меня', 'у', 'нас', 'я', 'было', 'были', 'была', 'был', 'будет', 'быть',
+    'пар', 'пары', 'пара', 'парами', 'парах', 'занятий', 'занятия', 'занятие', 'занятиями',
+    'в', 'во', 'по', 'на', 'и', 'или', 'а', 'но', 'с', 'со', 'к', 'же', 'за',
+    'пожалуйста', 'можно', 'надо', 'нужно', 'нужны', 'учиться', 'ходить', 'ездить',
+    'день', 'дни', 'дней', 'дня', 'все', 'всех', 'каждый', 'неделе', 'неделю', 'недели',
+    'расписание', 'расписании', 'так', 'это', 'еще', 'тоже', 'также', 'очень', 'вообще',
+    'однако', 'ставь', 'ставить', 'сделай', 'сделать', 'было', 'чем',
+} | NEGATIVE_WORDS | POSITIVE_WORDS | SOFT_WORDS
+
+# Запросы про преподавателей требуют точных имён из каталога: их разбирает Yandex GPT
+TEACHER_STEMS = ('преподав', 'лектор', 'семинарист', 'практик', 'вел', 'ведет', 'ведут')
+
+TOKEN_RE = re.compile(r'\d{1,2}[:.]\d{2}|\d+|[a-zа-я]+(?:-[a-zа-я0-9]+)*|[,.;!?]')
+
+EXCLUDE_GROUP_RE = re.compile(
+    r'исключи(?:ть|те)?\s+(?:группу|группы|группа)?[:\s]*(.+?)\s+([A-Za-zА-Яа-яЁё]{1,5}-?\d{2,}[\w-]*)',
+    re.IGNORECASE
+)
+
+
+def parse_filters(user_input):
+    """Разбирает пожелания пользователя в фильтры без обращения к Yandex GPT.
+
+    Возвращает пару (фильтры, уверенность от 0 до 1). Уверенность — доля
+    значимых слов запроса, которые покрыты распознанными конструкциями,
+    уменьшенная за каждое решение, принятое по умолчанию (например, день
+    без слов «только»/«не»). Запрос без распознанных фильтров имеет
+    уверенность 0. Фильтры из фраз со словами вроде «желательно» или
+    «по возможности» перечисляются в поле "soft" как мягкие.
+    """
+    filters, confidence = _parse_clause(user_input)
+    soft = _soft_keys(user_input) & filters.keys()
+    if soft:
+        filters["soft"] = dict.fromkeys(sorted(soft), 1)
+    return filters, confidence
+
+
+def _soft_keys(user_input):
+    """Фильтры, которые задаются только во фразах с маркером мягкого пожелания"""
+    text = user_input.lower().replace('ё', 'е')
+    tokens = [(m.group(0), m.start(), m.end()) for m in TOKEN_RE.finditer(text)]
+    words = [token[0] for token in tokens]
+    if not SOFT_WORDS & set(words):
+        return set()
+
+    soft, hard = set(), set()
+    i = 0
+    while i < len(words):
+        clause = _clause(words, i)
+        if len(clause):
+            phrase = text[tokens[clause.start][1]:tokens[clause.stop - 1][2]]
+            keys = _parse_clause(phrase)[0].keys()
+            (soft if SOFT_WORDS & {words[k] for k in clause} else hard).update(keys)
+        i = clause.stop + 1
+    return soft - hard
+
+
+def _parse_clause(user_input):
+    """Разбор без мягких пожеланий: (фильтры, уверенность)"""
+    filters = {}
+    penalty = 1.0
+
+    text = user_input.lower().replace('ё', 'е')
+    tokens = [(m.group(0), m.start(), m.end()) for m in TOKEN_RE.finditer(text)]
+    words = [token[0] for token in tokens]
+    covered = [False] * len(tokens)
+
+    def cover(start, end):
+        for k in range(start, end):
+            covered[k] = True
+
+    # Исключение групп: название предмета берём из исходного текста
+    for match in EXCLUDE_GROUP_RE.finditer(user_input):
+        filters.setdefault("excluded_groups", []).append({
+            "предмет": match.group(1).strip(' :,'),
+            "группа": match.group(2).strip()
+        })
+        for k, (_, start, end) in enumerate(tokens):
+            if start >= match.start() and end <= match.end():
+                covered[k] = True
+
+    # Ограничения количества идут раньше времени: «до 3 пар» — не время
+    i = 0
+    while i < len(words):
+        consumed = _parse_limit(words, covered, i, filters)
+        if consumed:
+            cover(i, consumed)
+            i = consumed
+        else:
+            i += 1
+
+    times = []
+    i = 0
+    while i < len(words):
+        if covered[i]:
+            i += 1
+            continue
+        consumed, ambiguous = _parse_time(words, covered, i, filters)
+        if consumed:
+            cover(i, consumed)
+            times.append(range(i, consumed))
+            penalty *= 0.5 if ambiguous else 1.0
+            i = consumed
+            continue
+        i += 1
+
+    i = 0
+    while i < len(words):
+        if covered[i] or _day_of(words[i]) is None:
+            i += 1
+            continue
+        days, end = _day_group(words, i)
+        polarity = _polarity(words, covered, i, end)
+        if polarity == 'neg':
+            _extend(filters, "exclude_days", days)
+        else:
+            _extend(filters, "preferred_days", days)
+            if polarity is None:
+                penalty *= 0.5
+        # «в среду пары до 12»: время может относиться только к этому дню, а так фильтры не умеют
+        if any(_same_clause(words, span, range(i, end)) for span in times):
+            penalty *= 0.5
+        cover(i, end)
+        i = end
+
+    for i, word in enumerate(words):
+        if covered[i]:
+            continue
+        if word.startswith(('утр', 'ранн')):
+            key = "no_morning_classes"
+        elif word.startswith(('вечер', 'поздн')):
+            key = "no_evening_classes"
+        elif word.startswith(('окн', 'окон')):
+            key = "no_gaps"
+        else:
+            continue
+        covered[i] = True
+        if _polarity(words, covered, i, i + 1) == 'neg':
+            filters[key] = True
+        else:
+            penalty *= 0.5
+
+    for i, word in enumerate(words):
+        if covered[i] or word != 'подряд':
+            continue
+        covered[i] = True
+        clause = _clause(words, i)
+        teacher = next((k for k in clause if words[k].startswith('преподав')), None)
+        if teacher is not None:
+            for k in clause:
+                if k == teacher or words[k] in ('одного', 'одному', 'одним', 'того', 'же'):
+                    covered[k] = True
+            filters["no_consecutive_teacher_classes"] = True
+        elif _polarity(words, covered, i, i + 1) == 'neg':
+            penalty *= 0.5
+        else:
+            filters["no_gaps"] = True
+
+    for i, word in enumerate(words):
+        if covered[i] or not word.startswith(('перерыв', 'перемен')):
+            continue
+        for k in _clause(words, i):
+            minutes = _number(words[k])
+            if minutes is not None and k + 1 < len(words) and words[k + 1].startswith('мин'):
+                filters["min_break"] = minutes
+                cover(k, k + 2)
+                covered[i] = True
+                # «не меньше 20 минут», «минимум 20 минут»
+                for q in _clause(words, i):
+                    if words[q] in ('меньше', 'менее', 'минимум', 'хотя', 'от'):
+                        covered[q] = True
+                break
+
+    if not filters:
+        return {}, 0.0
+
+    content = [
+        k for k, word in enumerate(words)
+        if word not in STOP_WORDS and word not in CLAUSE_BREAKS and not word.startswith(NEGATIVE_STEMS)
+    ]
+    if any(words[k].startswith(TEACHER_STEMS) for k in content if not covered[k]):
+        penalty *= 0.3
+    coverage = sum(covered[k] for k in content) / len(content) if content else 1.0
+
+    confidence = round(coverage * penalty, 3)
+    logger.debug(f"Локальный разбор «{user_input}»: {filters}, уверенность {confidence}")
+    return filters, confidence
+
+
+def _parse_limit(words, covered, i, filters):
+    """«не больше N пар в день/в пятницу», «максимум N преподавателей в день».
+
+    Возвращает индекс после конструкции или 0, если её нет.
+    """
+    if covered[i]:
+        return 0
+    start = i
+    if words[i] == 'не' and i + 1 < len(words) and words[i + 1] in ('больше', 'более'):
+        i += 2
+    elif words[i] in ('максимум', 'макс', 'максимально', 'до', 'только', 'лишь'):
+        i += 1
+    elif _number(words[i]) is None:
+        return 0
+
+    if i + 1 >= len(words):
+        return 0
+    count = _number(words[i])
+    if count is None:
+        return 0
+    noun = words[i + 1]
+    end = i + 2
+
+    if noun.startswith('преподавател'):
+        # «одного преподавателя» без маркера — не ограничение
+        if start == i:
+            return 0
+        if end + 1 < len(words) and words[end] == 'в' and words[end + 1] == 'день':
+            end += 2
+        filters["max_daily_teachers"] = count
+        return end
+
+    if not noun.startswith(('пар', 'заняти')):
+        return 0
+
+    if end + 1 < len(words) and words[end] in ('в', 'во', 'по') and _day_of(words[end + 1]) is not None:
+        days, end = _day_group(words, end + 1)
+    elif end + 1 < len(words) and words[end] == 'в' and words[end + 1] == 'день':
+        days, end = ALL_DAYS, end + 2
+    else:
+        # «в пятницу только одна пара»: день назван раньше в той же фразе
+        before = [k for k in _clause(words, start) if k < start and not covered[k] and _day_of(words[k])]
+        if before:
+            days = [_day_of(words[k]) for k in before]
+            for k in before:
+                covered[k] = True
+        elif start == i:
+            # Число пар без маркера и без дня ничего не ограничивает
+            return 0
+        else:
+            days = ALL_DAYS
+
+    limits = filters.get("max_classes_per_day")
+    if not isinstance(limits, dict):
+        limits = {}
+    for day in days:
+        limits[day] = count
+    filters["max_classes_per_day"] = limits
+    return end
+
+
+def _parse_time(words, covered, i, filters):
+    """Временные ограничения. Возвращает (индекс после конструкции, неоднозначна ли она)"""
+    word = words[i]
+    nxt = words[i + 1] if i + 1 < len(words) else ''
+
+    # «с 10 до 16», «с 9:30 по 15»
+    if word in ('с', 'со'):
+        start, k = _time_value(words, i + 1)
+        if start is None:
+            return 0, False
+        if k < len(words) and words[k] in ('до', 'по'):
+            end, m = _time_value(words, k + 1)
+            if end is not None:
+                filters["preferred_start_time"] = start
+                filters["preferred_end_time"] = end
+                return m, False
+        filters["preferred_start_time"] = start
+        return k, False
+
+    if word == 'не' and nxt in ('раньше', 'ранее'):
+        value, k = _time_value(words, i + 2)
+        if value is not None:
+            filters["preferred_start_time"] = value
+            return k, False
+    if word == 'не' and nxt in ('позже', 'позднее'):
+        value, k = _time_value(words, i + 2)
+        if value is not None:
+            filters["preferred_end_time"] = value
+            return k, False
+    if word == 'начиная' and nxt == 'с':
+        value, k = _time_value(words, i + 2)
+        if value is not None:
+            filters["preferred_start_time"] = value
+            return k, False
+
+    if word in ('до', 'к', 'после', 'позже', 'раньше'):
+        value, k = _time_value(words, i + 1)
+        if value is None:
+            return 0, False
+        negated = _polarity(words, covered, i, k) == 'neg'
+        ends = word in ('до', 'к', 'раньше')
+        # «не хочу пар после 16» — конец не позже 16, «не хочу пар до 10» — начало не раньше 10
+        if ends != negated:
+            filters["preferred_end_time"] = value
+        else:
+            filters["preferred_start_time"] = value
+        return k, word == 'раньше' and not negated
+
+    return 0, False
+
+
+def _time_value(words, i):
+    """Время вида 16, 16:30, 16.30, «4 вечера», «10 часов» -> ('HH:MM', индекс после)"""
+    if i >= len(words):
+        return None, i
+    match = re.fullmatch(r'(\d{1,2})(?:[:.](\d{2}))?', words[i])
+    if not match:
+        return None, i
+    hour = int(match.group(1))
+    minute = int(match.group(2) or 0)
+    k = i + 1
+    if k < len(words) and words[k] in ('час', 'часа', 'часов', 'ч'):
+        k += 1
+    if k < len(words) and words[k] in ('вечера', 'дня') and hour < 12:
+        hour += 12
+        k += 1
+    elif k < len(words) and words[k] in ('утра', 'ночи'):
+        k += 1
+    # «до 3 пар» — это количество, а не время
+    if k < len(words) and words[k].startswith(('пар', 'заняти', 'преподав')):
+        return None, i
+    if hour > 23 or minute > 59:
+        return None, i
+    return f"{hour:02d}:{minute:02d}", k
+
+
+def _day_group(words, i):
+    """Перечисление дней: «вторникам и четвергам», «пн, ср и пт». -> (дни, индекс после)"""
+    days = []
+    k = i
+    end = i
+    while k < len(words):
+        day = _day_of(words[k])
+        if day is not None:
+            if day not in days:
+                days.append(day)
+            k += 1
+            end = k
+        elif words[k] in ('и', 'или', ',', 'в', 'во', 'по'):
+            k += 1
+        else:
+            break
+    return days, end
+
+
+def _polarity(words, covered, start, end):
+    """Полярность упоминания в пределах фразы: 'neg', 'pos' или None.
+
+    Ближайший маркер перед упоминанием решает; если перед ним маркера нет,
+    учитывается отрицание после («понедельник не хочу»). Слова уже
+    разобранных конструкций пропускаются: «не» из «не позже 15» к дню
+    не относится.
+    """
+    k = start - 1
+    while k >= 0 and words[k] not in CLAUSE_BREAKS:
+        word = words[k]
+        if covered[k]:
+            pass
+        elif word in NEGATIVE_WORDS or word.startswith(NEGATIVE_STEMS):
+            return 'neg'
+        elif word in POSITIVE_WORDS:
+            return 'pos'
+        k -= 1
+    k = end
+    while k < len(words) and words[k] not in CLAUSE_BREAKS:
+        if not covered[k] and (words[k] in ('не', 'нет') or words[k].startswith(NEGATIVE_STEMS)):
+            return 'neg'
+        k += 1
+    return None
+
+
+def _same_clause(words, first, second):
+    """В одной ли фразе два диапазона слов, не разделённые союзом «и»"""
+    if first.start > second.start:
+        first, second = second, first
+    between = words[first.stop:second.start]
+    return not any(word in CLAUSE_BREAKS or word == 'и' for word in between)
+
+
+def _clause(words, i):
+    """Индексы слов фразы, в которую входит слово i"""
+    start = i
+    while start > 0 and words[start - 1] not in CLAUSE_BREAKS:
+        start -= 1
+    end = i
+    while end < len(words) and words[end] not in CLAUSE_BREAKS:
+        end += 1
+    return range(start, end)
+
+
+def _day_of(word):
+    for pattern, day in DAY_PATTERNS:
+        if pattern.fullmatch(word):
+            return day
+    return None
+
+
+def _number(word):
+    if word.isdigit():
+        return int(word)
+    return NUMBER_WORDS.get(word)
+
+
+def _extend(filters, key, values):
+    target = filters.setdefault(key, [])
+    for value in values:
+        if value not in target:
+            target.append(value)
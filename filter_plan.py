@@ -0,0 +1,513 @@
+import heapq
+import logging
+from collections import defaultdict
+from utils import time_to_minutes, normalize_day_name, normalize_name, normalize_group
+
+logger = logging.getLogger(__name__)
+
+# Границы для no_morning_classes («нет пар до 10:00») и no_evening_classes («нет пар после 18:00»)
+MORNING_END = 10 * 60
+EVENING_START = 18 * 60
+# Перерыв от этой длины считается окном; более короткий — пары идут подряд
+WINDOW_MINUTES = 60
+# Фильтры, которым нужен упорядоченный по времени список пар дня
+BREAK_FILTERS = ("min_break", "no_gaps", "no_consecutive_teacher_classes")
+# Стоимость расписания для ранжирования, в «минутах неудобства»:
+# день на кампусе, минута окна, минута до желаемого начала дня и предмет без желанного преподавателя
+DAY_COST = 90
+GAP_COST = 1
+EARLY_COST = 1
+TEACHER_COST = 60
+# Цена нарушения мягкого фильтра веса 1: любое нарушение хуже любого неудобства
+SOFT_COST = 10000
+SOFT_WEIGHT = 1
+
+# Описания фильтров для объяснения, какие мягкие пожелания не выполнены
+FILTER_DESCRIPTIONS = {
+    "exclude_days": "нет пар: {}",
+    "preferred_days": "пары только: {}",
+    "no_morning_classes": "нет пар до 10:00",
+    "no_evening_classes": "нет пар после 18:00",
+    "preferred_start_time": "начало не раньше {}",
+    "preferred_end_time": "конец не позже {}",
+    "min_break": "перерывы не короче {} мин",
+    "no_gaps": "без окон",
+    "max_classes_per_day": "ограничение числа пар в день",
+    "max_daily_teachers": "не больше {} преподавателей в день",
+    "preferred_teachers": "преподаватели: {}",
+    "excluded_teachers": "без преподавателей: {}",
+    "preferred_subject_teachers": "выбранные преподаватели по предметам",
+    "excluded_groups": "исключённые группы",
+    "max_teacher_classes_per_day": "ограничение пар одного преподавателя в день",
+    "no_consecutive_teacher_classes": "у преподавателя нет двух пар подряд",
+}
+
+
+def compile_filters(catalog, filters_chain):
+    """Компилирует цепочку наборов фильтров в план проверки компактных расписаний.
+
+    Расписание подходит, если проходит каждый набор цепочки. План состоит
+    из масок допустимых групп каждого предмета (по ним генератор отсекает
+    ветки ещё до перебора) и списка проверок готовых комбинаций,
+    упорядоченного от дешёвых к дорогим. Мягкие фильтры (поле "soft")
+    в план не входят: см. compile_soft.
+    """
+    return _compile_plan(_catalog_profile(catalog), filters_chain)
+
+
+def _compile_plan(profile, filters_chain):
+    domains = [(1 << len(teams)) - 1 for teams in profile["teams"]]
+    checks = []
+
+    for filters in filters_chain:
+        # Пустой набор фильтров не пропускает ничего
+        if not filters:
+            domains = [0] * len(domains)
+            continue
+        # Мягкие фильтры не отсекают расписания, их учитывает ранжирование
+        filters = hard_filters(filters)
+
+        domains = [a & b for a, b in zip(domains, _compile_domains(profile, filters))]
+
+        if "preferred_teachers" in filters:
+            checks.append((1, _compile_preferred_teachers(profile, filters["preferred_teachers"])))
+
+        day_limits = _day_limits(profile, filters.get("max_classes_per_day"))
+        if day_limits:
+            checks.append((2, _compile_max_classes_per_day(profile, day_limits)))
+
+        max_daily_teachers = _as_int(filters.get("max_daily_teachers"))
+        if max_daily_teachers is not None:
+            checks.append((2, _compile_max_daily_teachers(profile, max_daily_teachers)))
+
+        teacher_limits = _teacher_limits(profile, filters.get("max_teacher_classes_per_day"))
+        if teacher_limits:
+            checks.append((2, _compile_max_teacher_classes(profile, teacher_limits)))
+
+        if any(filters.get(key) for key in BREAK_FILTERS):
+            checks.append((3, _compile_break_rules(profile, filters)))
+
+    checks.sort(key=lambda check: check[0])
+    return {
+        "domains": domains,
+        "checks": [check for _, check in checks]
+    }
+
+
+def compile_cost(catalog, filters_chain):
+    """Компилирует модель стоимости расписания для ранжирования.
+
+    Стоимость складывается из дней на кампусе, минут окон между парами,
+    минут до желаемого начала дня (preferred_start_time, с
+    no_morning_classes или по умолчанию — MORNING_END) и предметов, группа
+    которых обходится без преподавателей из preferred_teachers. Веса
+    усиливаются, если пользователь сам упоминал окна или дни.
+    Для каждой группы хранятся по дням (первое начало, последний конец,
+    занятые минуты) и штраф за преподавателей; capacity — сколько минут
+    предмет самое большее может занять в каждый день: по ней оценивается,
+    насколько ещё могут сократиться окна, пока предмет не выбран.
+    """
+    profile = _catalog_profile(catalog)
+    filters_chain = [filters for filters in filters_chain if filters]
+
+    day_cost = DAY_COST
+    gap_cost = GAP_COST
+    if any(filters.get("exclude_days") or filters.get("preferred_days") for filters in filters_chain):
+        day_cost *= 2
+    if any(filters.get(key) for filters in filters_chain for key in BREAK_FILTERS):
+        gap_cost *= 3
+
+    start = MORNING_END
+    wanted = 0
+    for filters in filters_chain:
+        if "preferred_start_time" in filters:
+            start = max(start, time_to_minutes(filters["preferred_start_time"]))
+        wanted |= _teachers_mask(profile, filters.get("preferred_teachers", []))
+
+    teams = []
+    capacity = []
+    for subject_teams in profile["teams"]:
+        # Штрафуем только там, где желанного преподавателя вообще можно получить
+        reachable = any(team["teachers"] & wanted for team in subject_teams)
+        subject_costs = []
+        subject_capacity = defaultdict(int)
+        for team in subject_teams:
+            days = {}
+            for day, intervals in team["intervals"].items():
+                # Занятия с нераспознанным временем (0, 0) на стоимость не влияют
+                intervals = [(begin, end) for begin, end, _ in intervals if end > begin]
+                if intervals:
+                    busy = sum(end - begin for begin, end in intervals)
+                    days[day] = (intervals[0][0], max(end for _, end in intervals), busy)
+                    subject_capacity[day] = max(subject_capacity[day], busy)
+            penalty = TEACHER_COST if reachable and not team["teachers"] & wanted else 0
+            subject_costs.append((days, penalty))
+        teams.append(subject_costs)
+        capacity.append(dict(subject_capacity))
+
+    return {
+        "teams": teams,
+        "capacity": capacity,
+        "day_cost": day_cost,
+        "gap_cost": gap_cost,
+        "early_cost": EARLY_COST,
+        "start": start
+    }
+
+
+def hard_filters(filters):
+    """Набор фильтров без мягких: их нарушение допустимо"""
+    soft = soft_weights(filters)
+    return {key: value for key, value in filters.items() if key != "soft" and key not in soft}
+
+
+def soft_weights(filters):
+    """Мягкие фильтры набора с весами.
+
+    Поле "soft" — список названий фильтров (вес SOFT_WEIGHT) или словарь
+    {название: вес}; учитываются только фильтры, заданные в наборе.
+    """
+    soft = filters.get("soft") or {}
+    if isinstance(soft, list):
+        soft = dict.fromkeys(soft, SOFT_WEIGHT)
+    if not isinstance(soft, dict):
+        return {}
+    weights = {}
+    for key, weight in soft.items():
+        weight = _as_int(weight)
+        if key in filters and key != "soft" and weight is not None and weight > 0:
+            weights[key] = weight
+    return weights
+
+
+def relax_filters(filters):
+    """Тот же набор, где все фильтры мягкие (заданные веса сохраняются)"""
+    weights = dict.fromkeys((key for key in filters if key != "soft"), SOFT_WEIGHT)
+    weights.update(soft_weights(filters))
+    return {**filters, "soft": weights}
+
+
+def compile_soft(catalog, filters_chain):
+    """Компилирует мягкие фильтры цепочки: каждый — отдельный план со своим весом.
+
+    Нарушение мягкого фильтра, проверяемого по группам, видно сразу по
+    выбранной группе (её нет в domains), остальное — по checks на
+    готовой комбинации.
+    """
+    profile = _catalog_profile(catalog)
+    constraints = []
+    for filters in filters_chain:
+        for key, weight in soft_weights(filters).items():
+            plan = _compile_plan(profile, [{key: filters[key]}])
+            constraints.append({
+                "key": key,
+                "description": describe_filter(key, filters[key]),
+                "weight": weight,
+                "domains": plan["domains"],
+                "checks": plan["checks"]
+            })
+    return constraints
+
+
+def describe_filter(key, value):
+    """Короткое описание фильтра для пользователя"""
+    template = FILTER_DESCRIPTIONS.get(key, key)
+    if isinstance(value, list):
+        value = ", ".join(
+            " ".join(map(str, item.values())) if isinstance(item, dict) else str(item) for item in value
+        )
+    return template.format(value)
+
+
+def _catalog_profile(catalog):
+    """Декодирует каталог (schedule_model.Catalog) в числа: дни и преподаватели получают целые id.
+
+    Для каждой группы хранятся маски её дней и преподавателей, крайние
+    время начала и конца занятий, а по дням — отсортированные интервалы
+    (начало, конец, маска преподавателей) и маска преподавателей дня.
+    """
+    day_ids = {}
+    teacher_ids = {}
+    decoded = {}
+    teams = []
+
+    for subject_name, catalog_teams in zip(catalog.subjects, catalog.teams):
+        subject_teams = []
+
+        for team in catalog_teams:
+            lessons = []
+            for lesson in team.lessons:
+                # Одинаковые занятия в каталоге — один объект, декодируются один раз
+                if lesson not in decoded:
+                    teachers = 0
+                    for teacher in lesson.teachers:
+                        teachers |= 1 << teacher_ids.setdefault(teacher, len(teacher_ids))
+                    # Занятие с нераспознанным временем считается идущим с 0:00 до 0:00
+                    start, end = (lesson.start, lesson.end) if lesson.start is not None else (0, 0)
+                    decoded[lesson] = (day_ids.setdefault(lesson.day, len(day_ids)), start, end, teachers)
+                lessons.append(decoded[lesson])
+
+            intervals = defaultdict(list)
+            for day, start, end, teachers in lessons:
+                intervals[day].append((start, end, teachers))
+
+            subject_teams.append({
+                "key": (normalize_name(subject_name), normalize_group(str(team.name))),
+                "days": _mask_of(day for day, _, _, _ in lessons),
+                "teachers": _or_all(teachers for _, _, _, teachers in lessons),
+                "start": min((start for _, start, _, _ in lessons), default=None),
+                "end": max((end for _, _, end, _ in lessons), default=None),
+                "intervals": {day: sorted(day_intervals) for day, day_intervals in intervals.items()},
+                "day_teachers": {
+                    day: _or_all(teachers for _, _, teachers in day_intervals)
+                    for day, day_intervals in intervals.items()
+                }
+            })
+
+        teams.append(subject_teams)
+
+    return {
+        "subjects": list(catalog.subjects),
+        "teams": teams,
+        "day_ids": day_ids,
+        "teacher_ids": teacher_ids
+    }
+
+
+def _compile_domains(profile, filters):
+    """Маски групп, проходящих фильтры, которые проверяются по каждой группе отдельно.
+
+    exclude_days, preferred_days, preferred_start_time/preferred_end_time,
+    no_morning_classes/no_evening_classes, excluded_teachers, excluded_groups
+    и preferred_subject_teachers выполняются для расписания тогда и только
+    тогда, когда выполняются для каждой его группы.
+    """
+    excluded_days = _days_mask(profile, filters.get("exclude_days", []))
+    if filters.get("preferred_days"):
+        all_days = (1 << len(profile["day_ids"])) - 1
+        excluded_days |= all_days & ~_days_mask(profile, filters["preferred_days"])
+    excluded_teachers = _teachers_mask(profile, filters.get("excluded_teachers", []))
+    excluded_groups = _normalize_excluded_groups(filters.get("excluded_groups", []))
+    min_start = time_to_minutes(filters["preferred_start_time"]) if "preferred_start_time" in filters else None
+    max_end = time_to_minutes(filters["preferred_end_time"]) if "preferred_end_time" in filters else None
+    if filters.get("no_morning_classes"):
+        min_start = MORNING_END if min_start is None else max(min_start, MORNING_END)
+    if filters.get("no_evening_classes"):
+        max_end = EVENING_START if max_end is None else min(max_end, EVENING_START)
+
+    subject_teachers = filters.get("preferred_subject_teachers", {})
+    # Предмет из preferred_subject_teachers, которого нет в расписании, не пропускает ничего
+    if any(name not in profile["subjects"] for name in subject_teachers):
+        return [0] * len(profile["subjects"])
+
+    domains = []
+    for subject_name, teams in zip(profile["subjects"], profile["teams"]):
+        required = _teachers_mask(profile, subject_teachers[subject_name]) if subject_name in subject_teachers else None
+        domain = 0
+        for team_index, team in enumerate(teams):
+            if team["days"] & excluded_days or team["teachers"] & excluded_teachers:
+                continue
+            if required is not None and not team["teachers"] & required:
+                continue
+            if min_start is not None and team["start"] is not None and team["start"] < min_start:
+                continue
+            if max_end is not None and team["end"] is not None and team["end"] > max_end:
+                continue
+            if team["key"] in excluded_groups:
+                continue
+            domain |= 1 << team_index
+        domains.append(domain)
+    return domains
+
+
+def _compile_preferred_teachers(profile, teachers):
+    """preferred_teachers: хотя бы одно занятие расписания ведёт один из преподавателей"""
+    wanted = _teachers_mask(profile, teachers)
+    hits = [
+        _mask_of(team_index for team_index, team in enumerate(teams) if team["teachers"] & wanted)
+        for teams in profile["teams"]
+    ]
+
+    def check(team_indices):
+        for subject_hits, team in zip(hits, team_indices):
+            if subject_hits >> team & 1:
+                return True
+        return False
+
+    return check
+
+
+def _compile_max_classes_per_day(profile, day_limits):
+    """max_classes_per_day: не больше заданного числа пар в каждый из дней"""
+
+    def check(team_indices):
+        teams = _schedule_teams(profile, team_indices)
+        for day, limit in day_limits.items():
+            if sum(len(team["intervals"].get(day, ())) for team in teams) > limit:
+                return False
+        return True
+
+    return check
+
+
+def _compile_max_daily_teachers(profile, limit):
+    """max_daily_teachers: не больше limit разных преподавателей за день"""
+
+    def check(team_indices):
+        day_teachers = defaultdict(int)
+        for team in _schedule_teams(profile, team_indices):
+            for day, teachers in team["day_teachers"].items():
+                day_teachers[day] |= teachers
+        return all(teachers.bit_count() <= limit for teachers in day_teachers.values())
+
+    return check
+
+
+def _compile_max_teacher_classes(profile, teacher_limits):
+    """max_teacher_classes_per_day: не больше заданного числа пар преподавателя за день"""
+
+    def check(team_indices):
+        counts = defaultdict(int)
+        for team in _schedule_teams(profile, team_indices):
+            for day, intervals in team["intervals"].items():
+                for _, _, teachers in intervals:
+                    for teacher_bit, limit in teacher_limits.items():
+                        if teachers & teacher_bit:
+                            counts[day, teacher_bit] += 1
+                            if counts[day, teacher_bit] > limit:
+                                return False
+        return True
+
+    return check
+
+
+def _compile_break_rules(profile, filters):
+    """min_break, no_gaps и no_consecutive_teacher_classes за один проход по дням.
+
+    Интервалы групп отсортированы заранее, поэтому пары дня собираются
+    слиянием, без пересортировки, и каждое правило проверяется по соседним
+    парам за время, линейное по числу пар дня.
+    """
+    min_break = _as_int(filters.get("min_break")) or 0
+    max_break = WINDOW_MINUTES if filters.get("no_gaps") else None
+    no_consecutive = bool(filters.get("no_consecutive_teacher_classes"))
+
+    def check(team_indices):
+        for day_intervals in _schedule_days(_schedule_teams(profile, team_indices)):
+            previous = None
+            for interval in day_intervals:
+                if previous is not None:
+                    gap = interval[0] - previous[1]
+                    if gap < min_break:
+                        return False
+                    if max_break is not None and gap >= max_break:
+                        return False
+                    if no_consecutive and gap < WINDOW_MINUTES and interval[2] & previous[2]:
+                        return False
+                previous = interval
+        return True
+
+    return check
+
+
+def _schedule_teams(profile, team_indices):
+    return [teams[team] for teams, team in zip(profile["teams"], team_indices)]
+
+
+def _schedule_days(teams):
+    """Пары расписания по дням, упорядоченные по времени слиянием интервалов групп"""
+    by_day = defaultdict(list)
+    for team in teams:
+        for day, intervals in team["intervals"].items():
+            by_day[day].append(intervals)
+    for day_lists in by_day.values():
+        yield day_lists[0] if len(day_lists) == 1 else list(heapq.merge(*day_lists))
+
+
+def _day_limits(profile, limits):
+    """max_classes_per_day: {день: n} или одно число для всех дней -> {id дня: n}"""
+    if limits is None:
+        return {}
+    if isinstance(limits, dict):
+        result = {}
+        for day, limit in limits.items():
+            day = normalize_day_name(day)
+            limit = _as_int(limit)
+            if day in profile["day_ids"] and limit is not None:
+                result[profile["day_ids"][day]] = limit
+        return result
+    limit = _as_int(limits)
+    if limit is None:
+        return {}
+    return {day_id: limit for day_id in profile["day_ids"].values()}
+
+
+def _teacher_limits(profile, limits):
+    """max_teacher_classes_per_day: {преподаватель: n} -> {бит преподавателя: n}"""
+    if not isinstance(limits, dict):
+        return {}
+    result = {}
+    for teacher, limit in limits.items():
+        limit = _as_int(limit)
+        teacher_id = profile["teacher_ids"].get(str(teacher).strip())
+        if teacher_id is not None and limit is not None:
+            result[1 << teacher_id] = limit
+    return result
+
+
+def _as_int(value):
+    """Число из значения фильтра; None, если значение не задано или не число"""
+    if value is None or isinstance(value, bool):
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        logger.warning(f"Некорректное числовое значение фильтра: {value}")
+        return None
+
+
+def _days_mask(profile, days):
+    """Маска id дней; неизвестные в каталоге дни не дают битов"""
+    day_ids = profile["day_ids"]
+    return _mask_of(day_ids[day] for day in map(normalize_day_name, days) if day in day_ids)
+
+
+def _teachers_mask(profile, teachers):
+    """Маска id преподавателей; неизвестные в каталоге имена не дают битов"""
+    teacher_ids = profile["teacher_ids"]
+    return _mask_of(teacher_ids[name.strip()] for name in teachers if name.strip() in teacher_ids)
+
+
+def _mask_of(bits):
+    mask = 0
+    for bit in bits:
+        mask |= 1 << bit
+    return mask
+
+
+def _or_all(masks):
+    result = 0
+    for mask in masks:
+        result |= mask
+    return result
+
+
+def _normalize_excluded_groups(exclusions):
+    """Приводит фильтр excluded_groups к набору пар (предмет, группа)"""
+    excluded = set()
+    for exclusion in exclusions:
+        # Нормализуем название предмета и группы
+        if isinstance(exclusion, dict):
+            subject = normalize_name(exclusion.get("предмет", ""))
+            group = normalize_group(exclusion.get("группа", ""))
+        else:
+            # Обработка строкового формата
+            parts = exclusion.split(" ", 1)
+            subject = normalize_name(parts[0]) if len(parts) > 0 else ""
+            group = normalize_group(parts[1]) if len(parts) > 1 else ""
+
+        # Пропускаем пустые значения
+        if subject and group:
+            excluded.add((subject, group))
+    return excluded
+
@@ -0,0 +1,257 @@
+import os
+import signal
+import asyncio
+import logging
+import multiprocessing
+
+from config import GENERATION_WORKERS, GENERATION_QUEUE_SIZE, GENERATION_TIMEOUT, GENERATION_EXIT_GRACE
+from schedule_generator import generate_schedules
+from parallel_search import shutdown_search_pool
+
+logger = logging.getLogger(__name__)
+
+
+class GenerationBusy(Exception):
+    """У пользователя уже есть генерация в очереди или в работе"""
+
+
+class GenerationQueueFull(Exception):
+    """Очередь генерации переполнена"""
+
+
+class GenerationCancelled(Exception):
+    """Генерация отменена пользователем"""
+
+
+def _mp_context():
+    # forkserver не наследует потоки и цикл событий бота, spawn — запасной вариант
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+
+
+def _run_job(generate, user_id, conn):
+    """Точка входа процесса генерации"""
+    # Своя группа процессов: при отмене вместе с генерацией останавливаются и процессы её пула поиска
+    os.setpgrp()
+    try:
+        conn.send(generate(user_id))
+    except Exception as e:
+        logger.error(f"Ошибка генерации в процессе для {user_id}: {e}")
+        conn.send(False)
+    finally:
+        # Процессы пула не daemon: пока пул открыт, процесс генерации не завершится
+        shutdown_search_pool(wait=True)
+        conn.close()
+
+
+async def _wait_readable(*handles):
+    """Ждёт, пока один из дескрипторов (труба, sentinel процесса) станет готов к чтению, не занимая поток"""
+    loop = asyncio.get_running_loop()
+    ready = loop.create_future()
+
+    def on_ready():
+        if not ready.done():
+            ready.set_result(None)
+
+    for handle in handles:
+        loop.add_reader(handle, on_ready)
+    try:
+        await ready
+    finally:
+        for handle in handles:
+            loop.remove_reader(handle)
+
+
+def _kill(process):
+    """Останавливает процесс генерации вместе с запущенными им процессами"""
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+    except (ProcessLookupError, PermissionError):
+        # Процесс ещё не успел завести свою группу
+        process.terminate()
+
+
+async def _wait_exit(process):
+    await _wait_readable(process.sentinel)
+    process.join()
+
+
+def _receive(reader):
+    """Результат из трубы; False, если процесс завершился, ничего не прислав"""
+    try:
+        return reader.recv() if reader.poll() else False
+    except EOFError:
+        return False
+
+
+class _Job:
+    def __init__(self, user_id, notify):
+        self.user_id = user_id
+        self.notify = notify
+        self.position = None
+        self.process = None
+        self.result = asyncio.get_running_loop().create_future()
+        # Процесс задания ждёт только _execute; остальные ждут этого события
+        self.finished = asyncio.Event()
+
+
+class GenerationService:
+    """Очередь генерации расписаний в отдельных процессах.
+
+    Одновременно работает не больше workers процессов, остальные задания
+    ждут в очереди длиной до queue_size в порядке поступления. У каждого
+    пользователя не больше одного задания. Каждое задание получает
+    собственный процесс, поэтому отмена (/start, /cancel) действительно
+    останавливает вычисления, а не только перестаёт ждать результат.
+    generate(user_id) — функция уровня модуля, которую выполняет процесс.
+    """
+
+    def __init__(self, workers=GENERATION_WORKERS, queue_size=GENERATION_QUEUE_SIZE, timeout=GENERATION_TIMEOUT,
+                 generate=generate_schedules):
+        self._workers = workers
+        self._queue_size = queue_size
+        self._timeout = timeout
+        self._generate = generate
+        self._context = _mp_context()
+        self._pending = []
+        self._running = {}
+        self._jobs = {}
+
+    async def run(self, user_id, notify=None):
+        """Ставит генерацию в очередь и ждёт её результата.
+
+        notify(position) вызывается при каждом изменении места в очереди;
+        0 означает, что генерация началась. Бросает GenerationBusy,
+        GenerationQueueFull, GenerationCancelled или asyncio.TimeoutError,
+        если сама генерация длилась дольше timeout.
+        """
+        if user_id in self._jobs:
+            raise GenerationBusy(user_id)
+        if len(self._pending) >= self._queue_size:
+            raise GenerationQueueFull(user_id)
+
+        job = _Job(user_id, notify)
+        self._jobs[user_id] = job
+        self._pending.append(job)
+        self._dispatch()
+
+        try:
+            return await asyncio.shield(job.result)
+        except asyncio.CancelledError:
+            # Ожидающего отменили (например, по таймауту обработчика) — задание не нужно
+            await self.cancel(user_id)
+            raise
+
+    async def cancel(self, user_id):
+        """Отменяет задание пользователя и дожидается остановки его процесса.
+
+        Возвращает True, если было что отменять.
+        """
+        job = self._jobs.pop(user_id, None)
+        if job is None:
+            return False
+
+        if job in self._pending:
+            self._pending.remove(job)
+        started = self._running.pop(user_id, None) is job
+        if not job.result.done():
+            job.result.set_exception(GenerationCancelled(user_id))
+            # Исключение может так никто и не прочитать
+            job.result.exception()
+
+        if started:
+            # Процесс ждёт и освобождает _execute: цикл событий держит на дескриптор
+            # только одного читателя, и второй ожидающий отнял бы его у _execute
+            if job.process is not None and job.process.is_alive():
+                _kill(job.process)
+            await job.finished.wait()
+        logger.info(f"Генерация для пользователя {user_id} отменена")
+
+        self._dispatch()
+        return True
+
+    async def close(self):
+        """Отменяет все задания"""
+        for user_id in list(self._jobs):
+            await self.cancel(user_id)
+
+    def _dispatch(self):
+        """Запускает задания из очереди на свободные места и обновляет позиции"""
+        while self._pending and len(self._running) < self._workers:
+            job = self._pending.pop(0)
+            self._running[job.user_id] = job
+            asyncio.get_running_loop().create_task(self._execute(job))
+
+        for job in self._running.values():
+            self._set_position(job, 0)
+        for index, job in enumerate(self._pending, 1):
+            self._set_position(job, index)
+
+    def _set_position(self, job, position):
+        if job.position == position:
+            return
+        job.position = position
+        if job.notify is not None:
+            asyncio.get_running_loop().create_task(self._notify(job, position))
+
+    async def _notify(self, job, position):
+        try:
+            await job.notify(position)
+        except Exception as e:
+            logger.warning(f"Не удалось сообщить позицию в очереди пользователю {job.user_id}: {e}")
+
+    async def _execute(self, job):
+        # Задание отменили до того, как задача успела стартовать
+        if job.result.done():
+            job.finished.set()
+            return
+
+        reader, writer = self._context.Pipe(duplex=False)
+        try:
+            # Не daemon: генерации нужен собственный пул процессов поиска
+            job.process = self._context.Process(target=_run_job, args=(self._generate, job.user_id, writer))
+            job.process.start()
+            writer.close()
+            logger.info(f"Генерация для пользователя {job.user_id} запущена в процессе {job.process.pid}")
+
+            # Результат читается, как только пришёл: завершения процесса для этого ждать не нужно
+            await asyncio.wait_for(_wait_readable(reader.fileno(), job.process.sentinel), timeout=self._timeout)
+            result = _receive(reader)
+            if not job.result.done():
+                job.result.set_result(result)
+            try:
+                await asyncio.wait_for(_wait_exit(job.process), timeout=GENERATION_EXIT_GRACE)
+            except asyncio.TimeoutError:
+                logger.warning(f"Процесс генерации {job.process.pid} не завершился сам после результата")
+                _kill(job.process)
+                await _wait_exit(job.process)
+        except asyncio.TimeoutError:
+            _kill(job.process)
+            await _wait_exit(job.process)
+            if not job.result.done():
+                job.result.set_exception(asyncio.TimeoutError())
+        except Exception as e:
+            logger.error(f"Ошибка процесса генерации для {job.user_id}: {e}")
+            if not job.result.done():
+                job.result.set_result(False)
+        finally:
+            reader.close()
+            writer.close()
+            # Задание могли отменить, а пользователь уже поставить новое
+            if self._jobs.get(job.user_id) is job:
+                del self._jobs[job.user_id]
+            if self._running.get(job.user_id) is job:
+                del self._running[job.user_id]
+            job.finished.set()
+            self._dispatch()
+
+
+_service = None
+
+
+def get_generation_service():
+    """Общий для бота сервис генерации"""
+    global _service
+    if _service is None:
+        _service = GenerationService()
+    return _service
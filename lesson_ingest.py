@@ -0,0 +1,113 @@
+import re
+import logging
+from collections import defaultdict
+
+from utils import normalize_day_name
+
+logger = logging.getLogger(__name__)
+
+WEEKDAYS = ['понедельник', 'вторник', 'среда', 'четверг', 'пятница', 'суббота', 'воскресенье']
+WEEKDAY_INDEX = {day: i for i, day in enumerate(WEEKDAYS)}
+
+# «8:30–10:00», «08.30 - 10.00», «с 8:30 до 10:00»; «8-10» — только если полной записи нет,
+# чтобы номер аудитории вроде «1-2» не приняли за время
+TIME_RANGE_PATTERNS = [
+    re.compile(
+        r'(?:\bс\s*)?(?<![\d-])(\d{1,2})[:.](\d{2})\s*(?:[–—−-]|\bдо\b)\s*(\d{1,2})[:.](\d{2})(?!\d)',
+        re.IGNORECASE
+    ),
+    re.compile(
+        r'(?:\bс\s*)?(?<![\d-])(\d{1,2})()\s*(?:[–—−-]|\bдо\b)\s*(\d{1,2})()(?![\d:.])',
+        re.IGNORECASE
+    )
+]
+
+
+def ingest_lessons(data, filename):
+    """Единственный разбор занятий файла предмета.
+
+    Каждое занятие один раз превращается в запись каталога, где время уже
+    разобрано в минуты, день нормализован и получил номер дня недели,
+    а аудитория отделена от времени. Дальше по конвейеру строка
+    'Место и время' не разбирается. Возвращает {группа: [записи]};
+    проблемы с файлом логируются одним сообщением, а не на каждое занятие.
+    """
+    teams = defaultdict(list)
+    skipped = 0
+    bad_times = []
+
+    for lesson in data:
+        # Проверка обязательных полей
+        if not isinstance(lesson, dict) or 'день' not in lesson or 'команда' not in lesson:
+            skipped += 1
+            continue
+
+        record = _lesson_record(lesson)
+        if record["начало"] is None:
+            bad_times.append(lesson.get('Место и время', ''))
+        teams[lesson['команда']].append(record)
+
+    if skipped:
+        logger.warning(f"В {filename} пропущено занятий без дня или команды: {skipped}")
+    if bad_times:
+        logger.warning(
+            f"В {filename} не распознано время у {len(bad_times)} занятий, "
+            f"например: {bad_times[0]!r}"
+        )
+    return teams
+
+
+def _lesson_record(lesson):
+    """Запись каталога для одного занятия входного файла"""
+    day = normalize_day_name(str(lesson['день']).rstrip('.'))
+    place_time = str(lesson.get('Место и время') or '')
+    time_range, room = parse_place_time(place_time)
+    start, end = time_range if time_range else (None, None)
+
+    return {
+        "тип_занятия": lesson.get('тип занятия', ''),
+        "день": day,
+        "день_недели": WEEKDAY_INDEX.get(day),
+        "начало": start,
+        "конец": end,
+        "время": format_time_range(start, end),
+        "преподаватели": [
+            teacher.strip() for teacher in lesson.get('преподаватели') or [] if str(teacher).strip()
+        ],
+        "аудитория": room
+    }
+
+
+def parse_place_time(place_time):
+    """Разделяет строку 'Место и время' на ((начало, конец) в минутах, аудитория).
+
+    Время None, если его нет или оно некорректно (конец не позже начала,
+    несуществующие часы); аудиторией тогда считается вся строка.
+    """
+    match = next(filter(None, (pattern.search(place_time) for pattern in TIME_RANGE_PATTERNS)), None)
+    if not match:
+        return None, place_time.strip()
+
+    start_hour, start_min, end_hour, end_min = match.groups()
+    start = int(start_hour) * 60 + int(start_min or 0)
+    end = int(end_hour) * 60 + int(end_min or 0)
+    room = (place_time[:match.start()] + ' ' + place_time[match.end():]).strip(' ,;|')
+    room = ' '.join(room.split())
+
+    if int(start_hour) > 23 or int(end_hour) > 24 or int(start_min or 0) > 59 or int(end_min or 0) > 59:
+        return None, place_time.strip()
+    if end <= start:
+        return None, place_time.strip()
+    return (start, end), room
+
+
+def format_time_range(start, end):
+    """Время занятия для показа: '8:30–10:00', пустая строка — если неизвестно"""
+    if start is None or end is None:
+        return ""
+    return f"{format_minutes(start)}–{format_minutes(end)}"
+
+
+def format_minutes(minutes):
+    """Минуты от начала дня в виде '8:30'"""
+    return f"{minutes // 60}:{minutes % 60:02d}"
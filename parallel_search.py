@@ -0,0 +1,182 @@
+import os
+import json
+import uuid
+import logging
+import multiprocessing
+from multiprocessing import util
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from config import SEARCH_WORKERS, PARALLEL_MIN_SUBJECTS
+from schedule_store import load_json, load_catalog
+from schedule_generator import iter_assignments
+from filter_plan import compile_filters
+
+logger = logging.getLogger(__name__)
+
+# Как часто (в комбинациях) шард проверяет сигнал остановки
+STOP_CHECK_EVERY = 256
+
+_pool = None
+_shard_context = {}
+
+
+def use_parallel_search(index):
+    """Стоит ли делить перебор на шарды: только для больших наборов предметов"""
+    return SEARCH_WORKERS > 1 and len(index["subjects"]) >= PARALLEL_MIN_SUBJECTS
+
+
+def search_page(session_dir, index, catalog, filters_chain, limit, resume_after=None):
+    """Параллельно ищет следующие limit расписаний, проходящих цепочку фильтров.
+
+    Пространство комбинаций делится на шарды по группе предмета с
+    наибольшим числом групп; шарды перебираются в процессах пула, а их
+    результаты сливаются по мере готовности в порядке номеров групп.
+    Поэтому порядок выдачи детерминирован и перебор можно продолжить
+    с resume_after — последней выданной комбинации. Как только набрано
+    limit расписаний, остальные шарды получают сигнал остановки.
+    Возвращает (список комбинаций, исчерпан ли перебор).
+    """
+    plan = compile_filters(catalog, filters_chain)
+    subject = _shard_subject(index)
+    domain = plan["domains"][subject] & ((1 << len(index["teams"][subject])) - 1)
+    teams = [team for team in range(domain.bit_length()) if domain >> team & 1]
+    if resume_after is not None:
+        teams = [team for team in teams if team >= resume_after[subject]]
+    if not all(plan["domains"]):
+        teams = []
+
+    tasks = [
+        (team, resume_after if resume_after is not None and team == resume_after[subject] else None)
+        for team in teams
+    ]
+
+    pool = _get_pool()
+    if pool is not None:
+        try:
+            return _merge_parallel(pool, session_dir, filters_chain, subject, deque(tasks), limit)
+        except BrokenProcessPool as e:
+            # Шарды, бывшие в работе, и уже слитые результаты потеряны: страница
+            # собирается заново с начала, порядок перебора от этого не меняется
+            logger.error(f"Пул поиска сломан, перебор продолжится в текущем процессе: {e}")
+            _reset_pool()
+
+    found = []
+    for team, resume in tasks:
+        shard, _ = _search_shard(session_dir, filters_chain, subject, team, resume, limit - len(found))
+        found.extend(shard)
+        if len(found) >= limit:
+            return found, False
+    return found, True
+
+
+def _merge_parallel(pool, session_dir, filters_chain, subject, tasks, limit):
+    """Держит в работе не больше двух шардов на процесс и сливает их по порядку"""
+    stop_file = os.path.join(session_dir, f"search-{uuid.uuid4().hex}.stop")
+    window = deque()
+    found = []
+
+    def submit_next():
+        if tasks:
+            team, resume = tasks.popleft()
+            window.append(pool.submit(
+                _search_shard, session_dir, filters_chain, subject, team, resume, limit, stop_file
+            ))
+
+    for _ in range(2 * SEARCH_WORKERS):
+        submit_next()
+
+    try:
+        while window:
+            shard, _ = window.popleft().result()
+            found.extend(shard[:limit - len(found)])
+            if len(found) >= limit:
+                return found, False
+            submit_next()
+        return found, True
+    finally:
+        _stop_shards(window, stop_file)
+
+
+def _stop_shards(futures, stop_file):
+    """Останавливает недоделанные шарды и убирает сигнал, когда они завершатся"""
+    running = [future for future in futures if not future.cancel()]
+    if not running:
+        return
+
+    with open(stop_file, 'w'):
+        pass
+    remaining = [len(running)]
+
+    def on_done(_):
+        remaining[0] -= 1
+        if not remaining[0] and os.path.exists(stop_file):
+            os.remove(stop_file)
+
+    for future in running:
+        future.add_done_callback(on_done)
+
+
+def _search_shard(session_dir, filters_chain, subject, team, resume_after, limit, stop_file=None):
+    """Перебирает шард: комбинации, где предмет subject взят в группе team"""
+    index, plan = _load_shard_context(session_dir, filters_chain)
+    domains = list(plan["domains"])
+    domains[subject] &= 1 << team
+
+    found = []
+    for n, team_indices in enumerate(iter_assignments(index, resume_after, domains)):
+        if stop_file is not None and n % STOP_CHECK_EVERY == 0 and os.path.exists(stop_file):
+            return found, False
+        if all(check(team_indices) for check in plan["checks"]):
+            found.append(team_indices)
+            if len(found) >= limit:
+                return found, False
+    return found, True
+
+
+def _load_shard_context(session_dir, filters_chain):
+    """Индекс и план фильтров сессии, закэшированные в процессе пула"""
+    index_file = f"{session_dir}/index.json"
+    key = (session_dir, os.stat(index_file).st_mtime_ns, json.dumps(filters_chain, sort_keys=True))
+    if _shard_context.get("key") != key:
+        index = load_json(index_file)
+        catalog = load_catalog(f"{session_dir}/catalog.json")
+        _shard_context.update(key=key, index=index, plan=compile_filters(catalog, filters_chain))
+    return _shard_context["index"], _shard_context["plan"]
+
+
+def _shard_subject(index):
+    teams = index["teams"]
+    return max(range(len(teams)), key=lambda i: len(teams[i]))
+
+
+def _get_pool():
+    global _pool
+    if SEARCH_WORKERS <= 1:
+        return None
+    if _pool is None:
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+        _pool = ProcessPoolExecutor(max_workers=SEARCH_WORKERS, mp_context=context)
+        # Пул, открытый в дочернем процессе (вычислений сессии, генерации), закрывается при его выходе.
+        # Приоритет выше, чем у очередей multiprocessing (10): закрытая раньше очередь
+        # не донесёт процессам пула сигнал остановки, и выход зависнет
+        util.Finalize(None, _reset_pool, kwargs={"wait": True}, exitpriority=20)
+    return _pool
+
+
+def _reset_pool(wait=False):
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=wait, cancel_futures=True)
+        _pool = None
+
+
+def shutdown_search_pool(wait=False):
+    """Останавливает пул поиска.
+
+    В дочернем процессе (генерации) нужен wait=True: иначе при выходе он
+    ждёт процессы пула, которых никто не останавливает.
+    """
+    _reset_pool(wait)
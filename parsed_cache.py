@@ -0,0 +1,103 @@
+import os
+import logging
+
+from config import PARSED_CACHE_DIR, PARSED_CACHE_MAX_BYTES
+from schedule_store import write_json, load_json
+
+logger = logging.getLogger(__name__)
+
+# Версия формата записей: при изменении разбора старые записи просто не находятся
+CACHE_VERSION = 2
+# Вытеснение освобождает место с запасом, чтобы полный кэш не обходился на каждой записи
+EVICT_TARGET = 0.9
+
+# Размер кэша по оценке этого процесса: обход после последнего вытеснения плюс
+# записанное с тех пор им самим. None — кэш ещё не обходили
+_cache_bytes = None
+
+
+def _entry_path(kind, key):
+    # Подкаталоги по первым символам хэша, чтобы не держать тысячи файлов в одной папке
+    return f"{PARSED_CACHE_DIR}/v{CACHE_VERSION}/{kind}/{key[:2]}/{key}.json"
+
+
+def cache_get(kind, key):
+    """Запись общего кэша разборов или None.
+
+    Кэш общий для всех пользователей и процессов: ключ — хэш содержимого,
+    так что одинаковые файлы разбираются один раз. Чтение обновляет время
+    изменения записи, по которому вытесняются давно не использованные.
+    """
+    path = _entry_path(kind, key)
+    try:
+        data = load_json(path)
+        os.utime(path)
+        return data
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        # Запись могли вытеснить или повредить параллельно — разберём заново
+        logger.warning(f"Не удалось прочитать запись кэша {path}: {e}")
+        return None
+
+
+def cache_put(kind, key, data):
+    """Атомарно сохраняет запись и при необходимости вытесняет старые.
+
+    Кэш обходится целиком только при первой записи процесса и когда
+    оценка его размера превышает PARSED_CACHE_MAX_BYTES; записи других
+    процессов учитываются при следующем обходе.
+    """
+    global _cache_bytes
+    path = _entry_path(kind, key)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        write_json(path, data)
+        size = os.stat(path).st_size
+    except OSError as e:
+        logger.error(f"Не удалось сохранить запись кэша {path}: {e}")
+        return
+
+    if _cache_bytes is None or _cache_bytes + size > PARSED_CACHE_MAX_BYTES:
+        _cache_bytes = _evict()
+    else:
+        _cache_bytes += size
+
+
+def _evict():
+    """Обходит кэш и, если он больше PARSED_CACHE_MAX_BYTES, удаляет самые давно
+    использованные записи до EVICT_TARGET от предела. Возвращает оставшийся размер.
+    """
+    root = f"{PARSED_CACHE_DIR}/v{CACHE_VERSION}"
+    entries = []
+    total = 0
+    for folder, _, filenames in os.walk(root):
+        for filename in filenames:
+            # Недописанные записи других процессов не трогаем
+            if filename.endswith('.tmp'):
+                continue
+            path = os.path.join(folder, filename)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+
+    if total <= PARSED_CACHE_MAX_BYTES:
+        return total
+
+    entries.sort()
+    evicted = 0
+    for _, size, path in entries:
+        if total <= PARSED_CACHE_MAX_BYTES * EVICT_TARGET:
+            break
+        try:
+            os.remove(path)
+            evicted += 1
+        except FileNotFoundError:
+            # Ту же запись уже вытеснил другой процесс
+            pass
+        total -= size
+    logger.info(f"Из кэша разборов вытеснено записей: {evicted}")
+    return total
@@ -0,0 +1,146 @@
+import heapq
+import logging
+
+from config import RANKED_SEARCH_NODES
+from filter_plan import compile_filters, compile_cost, compile_soft, SOFT_COST
+
+logger = logging.getLogger(__name__)
+
+
+def top_schedules(index, catalog, filters_chain, k, node_limit=RANKED_SEARCH_NODES):
+    """Находит k расписаний с наименьшей стоимостью среди проходящих фильтры.
+
+    Ветви и границы: поиск в глубину по тем же доменам и таблице
+    совместимости, что и iter_assignments, но группы пробуются от самой
+    дешёвой, а ветка отсекается, как только нижняя оценка её стоимости
+    не лучше k-го из уже найденных расписаний. Найденные держатся в куче
+    из k элементов, остальные расписания нигде не накапливаются.
+    Мягкие фильтры не отсекают расписания, а добавляют к стоимости
+    SOFT_COST × вес за каждое нарушение, так что первыми идут наименее
+    нарушающие пожелания расписания. Если перебор упёрся в node_limit
+    узлов, возвращается лучшее из найденного. Возвращает (список
+    (стоимость, комбинация, описания нарушенных мягких фильтров) по
+    возрастанию стоимости, был ли перебор полным).
+    """
+    plan = compile_filters(catalog, filters_chain)
+    cost = compile_cost(catalog, filters_chain)
+    soft = compile_soft(catalog, filters_chain)
+    # Мягкие фильтры, которые нарушает сам выбор группы, — битовая маска на группу
+    team_soft = [
+        [
+            sum(1 << bit for bit, constraint in enumerate(soft) if not constraint["domains"][subject] >> team & 1)
+            for team in range(len(teams))
+        ]
+        for subject, teams in enumerate(index["teams"])
+    ]
+    soft_checked = [bit for bit, constraint in enumerate(soft) if constraint["checks"]]
+    soft_costs = {}
+    compatible = index["compatible"]
+    team_costs = cost["teams"]
+    capacity = cost["capacity"]
+    assignment = [None] * len(index["subjects"])
+    best = []
+    nodes = [0]
+    truncated = [False]
+
+    day_weight, gap_weight, early_weight, start = cost["day_cost"], cost["gap_cost"], cost["early_cost"], cost["start"]
+
+    def spare_minutes(unassigned):
+        # Окно может сократиться не больше, чем на минуты ещё не выбранных предметов этого дня
+        spare = {}
+        for subject in unassigned:
+            for day, minutes in capacity[subject].items():
+                spare[day] = spare.get(day, 0) + minutes
+        return spare
+
+    def bound(days, penalty, spare):
+        total = penalty + day_weight * len(days)
+        for day, (first, last, busy) in days.items():
+            gap = last - first - busy - spare.get(day, 0)
+            if gap > 0:
+                total += gap_weight * gap
+            if first < start:
+                total += early_weight * (start - first)
+        return total
+
+    def soft_cost(violated):
+        if violated not in soft_costs:
+            soft_costs[violated] = SOFT_COST * sum(
+                constraint["weight"] for bit, constraint in enumerate(soft) if violated >> bit & 1
+            )
+        return soft_costs[violated]
+
+    def search(domains, unassigned, days, penalty, violated):
+        nodes[0] += 1
+        if not unassigned:
+            team_indices = tuple(assignment)
+            if all(check(team_indices) for check in plan["checks"]):
+                for bit in soft_checked:
+                    if not violated >> bit & 1 and not all(check(team_indices) for check in soft[bit]["checks"]):
+                        violated |= 1 << bit
+                total = bound(days, penalty, {}) + soft_cost(violated)
+                item = (-total, _negated(assignment), violated)
+                if len(best) < k:
+                    heapq.heappush(best, item)
+                elif item[:2] > best[0][:2]:
+                    heapq.heapreplace(best, item)
+            return
+
+        current = min(unassigned, key=lambda i: domains[i].bit_count())
+        rest = [i for i in unassigned if i != current]
+        spare = spare_minutes(rest)
+        children = []
+        domain = domains[current]
+        while domain:
+            lowest = domain & -domain
+            domain ^= lowest
+            team = lowest.bit_length() - 1
+            row = compatible[current][team]
+            narrowed = list(domains)
+            for other in rest:
+                narrowed[other] &= row[other]
+                if not narrowed[other]:
+                    break
+            else:
+                team_days, team_penalty = team_costs[current][team]
+                merged = dict(days)
+                for day, (first, last, busy) in team_days.items():
+                    if day in merged:
+                        old_first, old_last, old_busy = merged[day]
+                        merged[day] = (min(first, old_first), max(last, old_last), busy + old_busy)
+                    else:
+                        merged[day] = (first, last, busy)
+                new_penalty = penalty + team_penalty
+                new_violated = violated | team_soft[current][team]
+                lower = bound(merged, new_penalty, spare) + soft_cost(new_violated)
+                children.append((lower, team, narrowed, merged, new_penalty, new_violated))
+
+        children.sort(key=lambda child: (child[0], child[1]))
+        for lower, team, narrowed, merged, new_penalty, new_violated in children:
+            if len(best) >= k and lower >= -best[0][0]:
+                break
+            if nodes[0] >= node_limit:
+                truncated[0] = True
+                break
+            assignment[current] = team
+            search(narrowed, rest, merged, new_penalty, new_violated)
+        assignment[current] = None
+
+    domains = [
+        domain & ((1 << len(team_names)) - 1) for domain, team_names in zip(plan["domains"], index["teams"])
+    ]
+    if k > 0 and all(domains):
+        search(domains, list(range(len(domains))), {}, 0, 0)
+
+    if truncated[0]:
+        logger.info(f"Поиск лучших расписаний остановлен после {node_limit} узлов")
+    ranked = sorted(
+        (-total, _negated(negated), [soft[bit]["description"] for bit in range(len(soft)) if violated >> bit & 1])
+        for total, negated, violated in best
+    )
+    return ranked, not truncated[0]
+
+
+def _negated(assignment):
+    # При равной стоимости в куче остаётся комбинация, меньшая лексикографически
+    return tuple(-team for team in assignment)
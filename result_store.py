@@ -0,0 +1,112 @@
+import os
+import json
+import shutil
+import hashlib
+import logging
+
+from config import RESULTS_DIR, RESULTS_MAX_ENTRIES
+from schedule_store import write_json, load_json
+
+logger = logging.getLogger(__name__)
+
+# Файлы сессии, которые целиком определяются загруженными предметами
+RESULT_FILES = ("index.json", "catalog.json", "count.json")
+
+# Версия формата: при изменении генерации старые результаты просто не находятся
+RESULT_VERSION = 3
+
+
+def result_key(subjects):
+    """Ключ результата генерации: отсортированные пары (предмет, хэш файла).
+
+    Название предмета входит в ключ, потому что оно попадает в каталог.
+    """
+    inputs = sorted((name, subject["hash"]) for name, subject in subjects)
+    payload = json.dumps([RESULT_VERSION, inputs], ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def restore_result(key, session_dir):
+    """Подставляет в сессию готовый результат генерации.
+
+    Файлы не копируются, а связываются жёсткими ссылками с единственной
+    копией в хранилище; число ссылок служит счётчиком сессий, которые
+    на неё опираются. Возвращает признак найденных расписаний или None,
+    если такого результата нет.
+    """
+    entry = f"{RESULTS_DIR}/{key}"
+    try:
+        meta = load_json(f"{entry}/meta.json")
+        for name in RESULT_FILES:
+            _link(f"{entry}/{name}", f"{session_dir}/{name}")
+        os.utime(f"{entry}/meta.json")
+        return meta["found"]
+    except (OSError, ValueError, KeyError) as e:
+        if not isinstance(e, FileNotFoundError):
+            logger.warning(f"Не удалось взять результат генерации {key}: {e}")
+        return None
+
+
+def store_result(key, session_dir, found):
+    """Сохраняет результат генерации сессии в общее хранилище"""
+    entry = f"{RESULTS_DIR}/{key}"
+    if os.path.exists(entry):
+        return
+
+    tmp_entry = f"{entry}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(tmp_entry, exist_ok=True)
+        for name in RESULT_FILES:
+            _link(f"{session_dir}/{name}", f"{tmp_entry}/{name}")
+        write_json(f"{tmp_entry}/meta.json", {"found": found})
+        # Каталог появляется целиком или не появляется: параллельная запись того же ключа проиграет
+        os.rename(tmp_entry, entry)
+    except OSError as e:
+        if not os.path.exists(entry):
+            logger.error(f"Не удалось сохранить результат генерации {key}: {e}")
+        shutil.rmtree(tmp_entry, ignore_errors=True)
+        return
+    _evict()
+
+
+def _link(src, dst):
+    """Атомарно заменяет dst жёсткой ссылкой на src (или копией на другой файловой системе)"""
+    tmp_path = f"{dst}.{os.getpid()}.link.tmp"
+    try:
+        os.link(src, tmp_path)
+    except FileExistsError:
+        os.remove(tmp_path)
+        os.link(src, tmp_path)
+    except OSError as e:
+        if isinstance(e, FileNotFoundError):
+            raise
+        shutil.copyfile(src, tmp_path)
+    os.replace(tmp_path, dst)
+
+
+def _evict():
+    """Оставляет не больше RESULTS_MAX_ENTRIES результатов.
+
+    Первыми удаляются давно не использованные результаты, на которые не
+    ссылается ни одна сессия. Сессиям удаление не мешает: их жёсткие
+    ссылки продолжают указывать на данные.
+    """
+    entries = []
+    for name in os.listdir(RESULTS_DIR):
+        entry = f"{RESULTS_DIR}/{name}"
+        if name.endswith('.tmp'):
+            continue
+        try:
+            used = os.stat(f"{entry}/meta.json").st_mtime
+            referenced = os.stat(f"{entry}/{RESULT_FILES[0]}").st_nlink > 1
+        except OSError:
+            continue
+        entries.append((referenced, used, entry))
+
+    excess = len(entries) - RESULTS_MAX_ENTRIES
+    if excess <= 0:
+        return
+    entries.sort()
+    for _, _, entry in entries[:excess]:
+        shutil.rmtree(entry, ignore_errors=True)
+    logger.info(f"Из хранилища результатов генерации удалено: {excess}")
@@ -0,0 +1,275 @@
+import random
+import logging
+
+from config import COUNT_NODES, COUNT_ENUMERATION_LIMIT, SAMPLE_DRAWS
+from filter_plan import compile_filters
+
+logger = logging.getLogger(__name__)
+
+
+class CountLimitExceeded(Exception):
+    """Подсчёт не уложился в заданное число узлов"""
+
+
+class SearchTreeCounter:
+    """Точное число валидных комбинаций групп без их перебора.
+
+    Считает по тому же дереву поиска, что и iter_assignments, но с двумя
+    сокращениями. Число комбинаций зависит только от сужённых доменов
+    ещё не выбранных предметов, поэтому оно запоминается по ним.
+    Предметы, группы которых уже не мешают друг другу, распадаются на
+    независимые компоненты, и число для узла — произведение чисел
+    компонент. domains — необязательные маски допустимых групп (как
+    у iter_assignments). Бросает CountLimitExceeded, если понадобилось
+    больше node_limit узлов.
+    """
+
+    def __init__(self, index, domains=None, node_limit=COUNT_NODES):
+        self._compatible = index["compatible"]
+        full = [(1 << len(team_names)) - 1 for team_names in index["teams"]]
+        if domains is None:
+            domains = full
+        self._domains = [domain & mask for domain, mask in zip(domains, full)]
+        self._node_limit = node_limit
+        self._nodes = 0
+        self._memo = {}
+        self.total = self._count(self._domains, tuple(range(len(full))))
+        # Дальше узлы считает только unrank, а он проходит одну ветку на уровень
+        self._node_limit = float("inf")
+
+    def unrank(self, rank):
+        """Комбинация с номером rank (0 <= rank < total).
+
+        Нумерация — биекция между числами и валидными комбинациями: в
+        каждом узле номер делится между ветками пропорционально их числам
+        комбинаций, поэтому равномерно случайный номер даёт равномерно
+        случайное расписание.
+        """
+        if not 0 <= rank < self.total:
+            raise IndexError(rank)
+        assignment = [None] * len(self._domains)
+        self._unrank(self._domains, tuple(range(len(self._domains))), rank, assignment)
+        return tuple(assignment)
+
+    def _unrank(self, domains, unassigned, rank, assignment):
+        if len(unassigned) == 1:
+            domain = domains[unassigned[0]]
+            for _ in range(rank):
+                domain &= domain - 1
+            assignment[unassigned[0]] = (domain & -domain).bit_length() - 1
+            return
+
+        if len(unassigned) >= 4:
+            components = self._components(domains, unassigned)
+            if len(components) > 1:
+                # Компоненты независимы: номер раскладывается по смешанной системе счисления
+                for component in components:
+                    rank, component_rank = divmod(rank, self._count(domains, component))
+                    self._unrank(domains, component, component_rank, assignment)
+                return
+
+        for (subject, team), narrowed, count in self._children(domains, unassigned):
+            if rank < count:
+                assignment[subject] = team
+                self._unrank(narrowed, tuple(i for i in unassigned if i != subject), rank, assignment)
+                return
+            rank -= count
+
+    def _count(self, domains, unassigned):
+        key = (unassigned, tuple(domains[i] for i in unassigned))
+        if key in self._memo:
+            return self._memo[key]
+
+        self._nodes += 1
+        if self._nodes > self._node_limit:
+            raise CountLimitExceeded(self._node_limit)
+
+        if len(unassigned) == 1:
+            result = domains[unassigned[0]].bit_count()
+        elif len(unassigned) == 2:
+            # Последние предметы считаются по таблице совместимости сразу, без узлов
+            first, second = unassigned
+            result = _count_pairs(self._compatible[first], domains[first], second, domains[second])
+        elif len(unassigned) == 3:
+            first, second, third = sorted(unassigned, key=lambda i: domains[i].bit_count())
+            rows = self._compatible[first]
+            result = 0
+            for team in _teams_of(domains[first]):
+                row = rows[team]
+                result += _count_pairs(
+                    self._compatible[second], domains[second] & row[second], third, domains[third] & row[third]
+                )
+        else:
+            components = self._components(domains, unassigned)
+            if len(components) > 1:
+                result = 1
+                for component in components:
+                    result *= self._count(domains, component)
+                    if not result:
+                        break
+            else:
+                result = sum(count for _, _, count in self._children(domains, unassigned))
+
+        self._memo[key] = result
+        return result
+
+    def _children(self, domains, unassigned):
+        """Ветви узла: (группа, сужённые домены, число комбинаций) для предмета с наименьшим доменом"""
+        current = min(unassigned, key=lambda i: (domains[i].bit_count(), i))
+        rest = tuple(i for i in unassigned if i != current)
+        children = []
+        domain = domains[current]
+        while domain:
+            lowest = domain & -domain
+            domain ^= lowest
+            team = lowest.bit_length() - 1
+            row = self._compatible[current][team]
+            narrowed = list(domains)
+            for other in rest:
+                narrowed[other] &= row[other]
+                if not narrowed[other]:
+                    break
+            else:
+                narrowed[current] = lowest
+                children.append(((current, team), narrowed, self._count(narrowed, rest)))
+        return children
+
+    def _components(self, domains, unassigned):
+        """Разбивает предметы на группы, которые при текущих доменах не влияют друг на друга"""
+        compatible = self._compatible
+        neighbours = {i: [] for i in unassigned}
+        for position, first in enumerate(unassigned):
+            for second in unassigned[position + 1:]:
+                other_domain = domains[second]
+                domain = domains[first]
+                while domain:
+                    lowest = domain & -domain
+                    domain ^= lowest
+                    if compatible[first][lowest.bit_length() - 1][second] & other_domain != other_domain:
+                        neighbours[first].append(second)
+                        neighbours[second].append(first)
+                        break
+
+        components = []
+        seen = set()
+        for start in unassigned:
+            if start in seen:
+                continue
+            seen.add(start)
+            stack = [start]
+            component = []
+            while stack:
+                subject = stack.pop()
+                component.append(subject)
+                for other in neighbours[subject]:
+                    if other not in seen:
+                        seen.add(other)
+                        stack.append(other)
+            components.append(tuple(sorted(component)))
+        return components
+
+
+def build_counter(index, domains=None, node_limit=COUNT_NODES):
+    """SearchTreeCounter для доменов или None, если подсчёт оказался слишком долгим"""
+    try:
+        return SearchTreeCounter(index, domains, node_limit)
+    except CountLimitExceeded:
+        logger.info(f"Подсчёт расписаний остановлен после {node_limit} узлов")
+        return None
+
+
+def count_schedules(index, domains=None, node_limit=COUNT_NODES):
+    """Точное число валидных комбинаций или None, если подсчёт оказался слишком долгим"""
+    counter = build_counter(index, domains, node_limit)
+    return counter.total if counter is not None else None
+
+
+def count_matching(index, catalog, filters_chain, bound):
+    """Число расписаний, проходящих цепочку фильтров: (число, точное ли оно).
+
+    bound — число комбинаций с подходящими группами (count_schedules по
+    доменам плана фильтров, None, если его слишком долго считать): его
+    считает вызывающий, чтобы не строить счётчик повторно. Фильтры по
+    группам сужают домены и считаются так же точно, как все расписания.
+    Проверки целых расписаний (окна, число пар в день и т.п.) без
+    перебора не сосчитать: если комбинаций с подходящими группами не
+    больше COUNT_ENUMERATION_LIMIT, они перебираются, иначе bound
+    возвращается как оценка сверху. (None, False), если bound неизвестен.
+    """
+    # Импорт здесь: schedule_generator сам опирается на count_schedules
+    from schedule_generator import iter_assignments
+
+    plan = compile_filters(catalog, filters_chain)
+    if bound is None:
+        return None, False
+    if not plan["checks"] or not bound:
+        return bound, True
+    if bound > COUNT_ENUMERATION_LIMIT:
+        return bound, False
+
+    matched = sum(
+        1 for team_indices in iter_assignments(index, None, plan["domains"])
+        if all(check(team_indices) for check in plan["checks"])
+    )
+    return matched, True
+
+
+def sample_schedules(index, catalog, filters_chain, seed, limit, draws=0, exclude=(), max_draws=SAMPLE_DRAWS,
+                     counter=None):
+    """Равномерная случайная выборка расписаний, проходящих фильтры, без повторов.
+
+    Номера комбинаций с подходящими группами тянутся без повторов из
+    random.Random(seed) и превращаются в комбинации через unrank, так что
+    каждое расписание выпадает с одинаковой вероятностью и перебирать
+    их не нужно. Проверки целых расписаний отбрасывают неподходящие, что
+    равномерности среди подходящих не нарушает. Тот же seed даёт ту же
+    последовательность, поэтому выборку можно продолжать страницами:
+    draws — сколько номеров уже вытянуто прежде (они воспроизводятся без
+    разбора), за вызов тянется не больше max_draws новых. Комбинации из
+    exclude пропускаются. counter — уже построенный build_counter по
+    доменам плана фильтров, если он есть у вызывающего. Возвращает
+    (комбинации, draws, вытянуты ли все номера) или None, если подходящие
+    слишком долго считать.
+    """
+    plan = compile_filters(catalog, filters_chain)
+    if counter is None:
+        counter = build_counter(index, plan["domains"])
+        if counter is None:
+            logger.info("Выборка невозможна: подходящие расписания не удалось сосчитать")
+            return None
+
+    rnd = random.Random(seed)
+    seen = set()
+
+    def draw():
+        while True:
+            rank = rnd.randrange(counter.total)
+            if rank not in seen:
+                seen.add(rank)
+                return rank
+
+    for _ in range(draws):
+        draw()
+
+    found = []
+    stop = min(counter.total, draws + max_draws)
+    while len(found) < limit and draws < stop:
+        team_indices = counter.unrank(draw())
+        draws += 1
+        if team_indices in exclude:
+            continue
+        if all(check(team_indices) for check in plan["checks"]):
+            found.append(team_indices)
+    return found, draws, draws == counter.total
+
+
+def _count_pairs(rows, domain, other, other_domain):
+    """Число совместимых пар групп двух предметов"""
+    return sum((rows[team][other] & other_domain).bit_count() for team in _teams_of(domain))
+
+
+def _teams_of(domain):
+    while domain:
+        lowest = domain & -domain
+        domain ^= lowest
+        yield lowest.bit_length() - 1
@@ -1,12 +1,23 @@
 # schedule_filter.py
 import os
 import json
-import requests
-import re
+import asyncio
+import hashlib
 import logging
-from config import YANDEX_GPT_API_KEY, YANDEX_GPT_URL, SESSIONS_DIR
-from utils import time_to_minutes, normalize_day_name, parse_time
-from collections import defaultdict
+from config import (
+    SESSIONS_DIR,
+    FILTER_CACHE_PATH, FILTER_CACHE_SIZE, FILTER_CACHE_TTL, RANKED_TOP_K, SAMPLE_MIN_COUNT, SAMPLE_BATCH
+)
+from schedule_store import write_json, load_json, load_catalog, expand_schedule
+from schedule_generator import iter_assignments
+from filter_plan import compile_filters, relax_filters
+from parallel_search import use_parallel_search, search_page
+from ranked_search import top_schedules
+from diagnosis import diagnose_filters
+from schedule_count import build_counter, count_matching, sample_schedules
+from yandex_gpt import get_client
+from filter_cache import FilterCache
+from filter_parser import parse_filters, CONFIDENCE_THRESHOLD
 
 logger = logging.getLogger(__name__)
 
@@ -27,6 +38,7 @@ PROMPT_TEMPLATE = """Ты — помощник по составлению ра
 12. Все временные ограничения типа "до 16" преобразуй в "preferred_end_time": "16:00"
 13. Дни недели указывай в нижнем регистре (понедельник, вторник)
 14. Для исключения групп используй фильтр excluded_groups в формате: {"excluded_groups": [{"предмет": "Математика", "группа": "АТ-01"}]}
+15. Если пожелание необязательное ("желательно", "по возможности", "если получится") - добавь его фильтр как обычно и перечисли его название в "soft" с весом от 1 до 3 (важнее - больше)
 
 Доступные фильтры:
 - exclude_days: ["понедельник"] - дни для исключения
@@ -45,6 +57,7 @@ PROMPT_TEMPLATE = """Ты — помощник по составлению ра
 - excluded_groups: [{{"предмет": "Математика", "группа": "АТ-01"}}] - исключить эти группы
 - max_teacher_classes_per_day: {{"Лавров": 1}} - макс. пар/день
 - no_consecutive_teacher_classes: true - не две подряд
+- soft: {{"no_gaps": 1}} - какие из заданных фильтров мягкие и их веса
 
 Примеры запросов и соответствующих фильтров:
 1. "Не хочу пар в понедельник" → {{"exclude_days": ["понедельник"]}}
@@ -55,356 +68,353 @@ PROMPT_TEMPLATE = """Ты — помощник по составлению ра
 6. "пары до 15" → {"preferred_end_time": "15:00"}
 7. "не хочу пар в пятницу и после 16" → {"exclude_days": ["пятница"], "preferred_end_time": "16:00"}
 8. "исключи группу Векторный анализ АТ-03" → {"excluded_groups": [{"предмет": "Векторный анализ", "группа": "АТ-03"}]}
+9. "не хочу пар в понедельник, желательно без окон" → {"exclude_days": ["понедельник"], "no_gaps": true, "soft": {"no_gaps": 1}}
 
 Пожелания пользователя: "{user_input}"
 """
 
+MODEL_URI = "gpt://b1gu5hu4elo0ishbti6b/yandexgpt-lite"
 
-def generate_filters(user_input):
-    """Генерирует фильтры на основе пользовательского ввода"""
-    headers = {
-        "Authorization": f"Api-Key {YANDEX_GPT_API_KEY}",
-        "Content-Type": "application/json"
-    }
+# Кэш фильтров привязан к промпту и модели: их правка сбрасывает его
+_filter_cache = FilterCache(
+    FILTER_CACHE_PATH,
+    version=hashlib.sha256(f"{MODEL_URI}\n{PROMPT_TEMPLATE}".encode('utf-8')).hexdigest(),
+    max_entries=FILTER_CACHE_SIZE,
+    ttl=FILTER_CACHE_TTL
+)
 
-    prompt = PROMPT_TEMPLATE.replace("{user_input}", user_input.replace("{", "{{").replace("}", "}}"))
 
-    data = {
-        "modelUri": "gpt://b1gu5hu4elo0ishbti6b/yandexgpt-lite",
-        "completionOptions": {
-            "stream": False,
-            "temperature": 0.3,
-            "maxTokens": 1000
-        },
-        "messages": [{
-            "role": "user",
-            "text": prompt
-        }]
-    }
+async def generate_filters_async(user_input):
+    """Генерирует фильтры на основе пользовательского ввода, не блокируя цикл событий бота"""
+    local = _local_filters(user_input)
+    if local is not None:
+        return local
+
+    # Кэш читает и пишет файл: это делается в потоке, а не в цикле событий
+    loop = asyncio.get_running_loop()
+    cached = await loop.run_in_executor(None, _filter_cache.get, user_input)
+    if cached is not None:
+        return cached
 
     try:
-        response = requests.post(YANDEX_GPT_URL, headers=headers, json=data, timeout=15)
-        response.raise_for_status()
-        result = response.json()
-        text = result['result']['alternatives'][0]['message']['text'].strip()
-        if not text:
-            raise ValueError("Пустой ответ от Yandex GPT API")
-
-        # Очистка ответа
-        text = text.strip('`').strip()
-        if text.startswith('json'):
-            text = text[4:].strip()
-
-        return json.loads(text)
+        result = await get_client().complete(_build_request(user_input))
+        filters = _parse_completion(result)
     except Exception as e:
         logger.error(f"Ошибка генерации фильтров: {e}")
         return _fallback_filters(user_input)
 
+    # Запасные фильтры не кэшируются: при следующем запросе API может ответить
+    await loop.run_in_executor(None, _remember_filters, user_input, filters)
+    return filters
 
-def _fallback_filters(user_input):
-    """Фолбэк-режим для генерации фильтров"""
-    filters = {}
-
-    # Обработка дней недели
-    days = ['понедельник', 'вторник', 'среда', 'четверг', 'пятница', 'суббота', 'воскресенье']
-    exclude_days = [day for day in days if day in user_input.lower()]
-    if exclude_days:
-        filters["exclude_days"] = exclude_days
-
-    # Обработка времени
-    time_patterns = [
-        (r"до (\d{1,2})", "preferred_end_time"),
-        (r"после (\d{1,2})", "preferred_start_time"),
-        (r"с (\d{1,2}) до (\d{1,2})", "time_range")
-    ]
-
-    for pattern, filter_type in time_patterns:
-        match = re.search(pattern, user_input)
-        if match:
-            if filter_type == "time_range":
-                start = match.group(1).zfill(2)
-                end = match.group(2).zfill(2)
-                filters["preferred_start_time"] = f"{start}:00"
-                filters["preferred_end_time"] = f"{end}:00"
-            else:
-                hour = match.group(1).zfill(2)
-                filters[filter_type] = f"{hour}:00"
-
-    # Обработка связки предмет-преподаватель
-    subject_teacher_pattern = r"((?:[А-Яа-я]+\s?)+)\s+(?:вести|вестил?|преподавать?|вести\s+)?\s*([А-Яа-я]+)"
-    matches = re.findall(subject_teacher_pattern, user_input)
-    if matches:
-        preferred_subject_teachers = {}
-        for subject, teacher in matches:
-            subject = subject.strip().lower().capitalize()
-            teacher = teacher.strip()
-            if subject not in preferred_subject_teachers:
-                preferred_subject_teachers[subject] = []
-            preferred_subject_teachers[subject].append(teacher)
-        filters["preferred_subject_teachers"] = preferred_subject_teachers
-        
-    # Обработка исключения групп
-    exclude_pattern = r"исключи(?:те)?\s+группу?\s*([\w\s]+)\s+([\w\d-]+)"
-    matches = re.findall(exclude_pattern, user_input, re.IGNORECASE)
-    if matches:
-        excluded_groups = []
-        for subject, group in matches:
-            excluded_groups.append({
-                "предмет": subject.strip(),
-                "группа": group.strip()
-            })
-        filters["excluded_groups"] = excluded_groups
 
-    return filters
+def _remember_filters(user_input, filters):
+    """Кладёт ответ Yandex GPT в кэш и пишет в лог, насколько кэш помогает"""
+    _filter_cache.put(user_input, filters)
+    log_filter_cache_stats()
 
 
+def _local_filters(user_input):
+    """Фильтры локального разбора, если он уверен в результате, иначе None"""
+    filters, confidence = parse_filters(user_input)
+    if confidence < CONFIDENCE_THRESHOLD:
+        return None
+    logger.info(f"Фильтры разобраны локально (уверенность {confidence}): {filters}")
+    return filters
 
 
+def filter_cache_stats():
+    """Статистика кэша фильтров: попадания, промахи, размер"""
+    return _filter_cache.stats()
 
-def apply_filters_to_list(user_id, filters, schedules_list):
-    """Применяет фильтры к уже отфильтрованному списку расписаний"""
-    output_file = f"{SESSIONS_DIR}/{user_id}/matched_schedules.json"
-    
-    try:
-        # Применяем основные фильтры
-        matched = [s for s in schedules_list if _matches_filters(s, filters)]
-        
-        # Применяем фильтр исключения групп
-        if "excluded_groups" in filters:
-            filtered = []
-            for schedule in matched:
-                keep = True
-                for exclusion in filters["excluded_groups"]:
-                    # Нормализуем название предмета и группы
-                    if isinstance(exclusion, dict):
-                        subject = normalize_name(exclusion.get("предмет", ""))
-                        group = normalize_group(exclusion.get("группа", ""))
-                    else:
-                        # Обработка строкового формата
-                        parts = exclusion.split(" ", 1)
-                        subject = normalize_name(parts[0]) if len(parts) > 0 else ""
-                        group = normalize_group(parts[1]) if len(parts) > 1 else ""
-                    
-                    # Пропускаем пустые значения
-                    if not subject or not group:
-                        continue
-                        
-                    for s_subject in schedule["предметы"]:
-                        # Нормализуем название предмета в расписании
-                        s_name = normalize_name(s_subject["название_предмета"])
-                        s_group = normalize_group(str(s_subject["группа"]))
-                        
-                        if s_name == subject and s_group == group:
-                            keep = False
-                            break
-                    if not keep:
-                        break
-                if keep:
-                    filtered.append(schedule)
-            matched = filtered
-
-        result = {
-            "filters": filters,
-            "matched_schedules": matched,
-            "count": len(matched)
-        }
-
-        # Сохраняем результат
-        with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump(result, f, ensure_ascii=False, indent=2)
-
-        return len(matched)
-    
-    except Exception as e:
-        logger.error(f"Ошибка в apply_filters_to_list: {e}")
-        return 0
-
-def normalize_name(name: str) -> str:
-    """Нормализует название предмета для сравнения"""
-    if not name:
-        return ""
-    # Приводим к нижнему регистру, удаляем пробелы, заменяем разделители
-    return name.strip().lower().replace(" ", "").replace("_", "").replace("-", "")
-
-def normalize_group(group: str) -> str:
-    """Нормализует название группы для сравнения"""
-    if not group:
-        return ""
-    # Приводим к верхнему регистру, удаляем пробелы
-    return group.strip().upper().replace(" ", "")
-
-def apply_filters(user_id, filters):
-    """Применяет фильтры к ВСЕМ расписаниям пользователя"""
-    schedules_file = f"{SESSIONS_DIR}/{user_id}/schedules.json"
-    output_file = f"{SESSIONS_DIR}/{user_id}/matched_schedules.json"
 
-    try:
-        # Чтение всех расписаний из файла
-        with open(schedules_file, 'r', encoding='utf-8-sig') as f:
-            schedules = json.load(f)
-        
-        return apply_filters_to_list(user_id, filters, schedules)
-    
-    except Exception as e:
-        logger.error(f"Критическая ошибка в apply_filters: {e}")
-        raise
-
-
-def _matches_filters(schedule, filters):
-    """Проверяет соответствие расписания фильтрам"""
-    if not filters or not schedule:
-        return False
-
-    # Собираем статистику по дням
-    day_stats = {}
-    subject_teachers = {}  # Для фильтрации по связке предмет-преподаватель
-
-    for subject in schedule["предметы"]:
-        subject_name = subject["название_предмета"]
-        subject_teachers[subject_name] = set()
-
-        for cls in subject["занятия"]:
-            day = normalize_day_name(cls["день"])
-
-            if day not in day_stats:
-                day_stats[day] = {
-                    'classes': [],
-                    'teachers': set()
-                }
-
-            # Парсим время с помощью parse_time
-            start_time, end_time = 0, 0
-            if "время" in cls and cls["время"]:
-                try:
-                    time_range = parse_time(cls["время"])
-                    if time_range:
-                        (start_hour, start_min), (end_hour, end_min) = time_range
-                        start_time = start_hour * 60 + start_min
-                        end_time = end_hour * 60 + end_min
-                except Exception as e:
-                    logger.warning(f"Ошибка парсинга времени: {e}")
-
-            # Сохраняем данные о занятии
-            teachers_list = [t.strip() for t in cls["преподаватели"]]
-            class_data = {
-                'start': start_time,
-                'end': end_time,
-                'teachers': teachers_list,
-                'subject': subject_name
-            }
-
-            day_stats[day]['classes'].append(class_data)
-            day_stats[day]['teachers'].update(teachers_list)
-            subject_teachers[subject_name].update(teachers_list)
-
-    # 1. Проверка фильтра по связке предмет-преподаватель
-    if "preferred_subject_teachers" in filters:
-        for subject_name, required_teachers in filters["preferred_subject_teachers"].items():
-            subject_found = False
-            for s in schedule["предметы"]:
-                if s["название_предмета"] != subject_name:
-                    continue
-
-                # Проверяем преподавателей для этого предмета
-                teacher_match = False
-                for cls in s["занятия"]:
-                    if any(t in required_teachers for t in cls["преподаватели"]):
-                        teacher_match = True
-                        break
-
-                if not teacher_match:
-                    return False
-                subject_found = True
-                break
-
-            if not subject_found:
-                return False
-
-    # 2. Исключенные дни
-    if "exclude_days" in filters:
-        for day in filters["exclude_days"]:
-            if day in day_stats:
-                return False
-
-    # 3. Время начала/окончания
-    if "preferred_start_time" in filters:
-        min_start = time_to_minutes(filters["preferred_start_time"])
-        for day, stats in day_stats.items():
-            for cls in stats['classes']:
-                if cls['start'] < min_start:
-                    return False
-
-    if "preferred_end_time" in filters:
-        max_end = time_to_minutes(filters["preferred_end_time"])
-        for day, stats in day_stats.items():
-            for cls in stats['classes']:
-                if cls['end'] > max_end:
-                    return False
-
-    # 4. Общие фильтры по преподавателям
-    if "preferred_teachers" in filters:
-        found = False
-        for day, stats in day_stats.items():
-            for cls in stats['classes']:
-                if any(teacher in filters["preferred_teachers"] for teacher in cls['teachers']):
-                    found = True
-                    break
-            if found:
-                break
-        if not found:
-            return False
-
-    if "excluded_teachers" in filters:
-        for day, stats in day_stats.items():
-            for cls in stats['classes']:
-                if any(teacher in filters["excluded_teachers"] for teacher in cls['teachers']):
-                    return False
-
-    return True
-
-
-def generate_report(user_id):
-    """Генерирует отчет для пользователя"""
-    input_file = f"{SESSIONS_DIR}/{user_id}/matched_schedules.json"
-    output_file = f"{SESSIONS_DIR}/{user_id}/schedules_report.txt"
+def log_filter_cache_stats():
+    """Пишет статистику кэша фильтров в лог"""
+    stats = filter_cache_stats()
+    logger.info(
+        f"Кэш фильтров: попаданий {stats['hits']}, промахов {stats['misses']} "
+        f"({stats['hit_rate']:.0%}), записей {stats['size']}"
+    )
 
-    try:
-        with open(input_file, 'r', encoding='utf-8') as f:
-            data = json.load(f)
 
-        matched_schedules = data.get("matched_schedules", [])
-        report_lines = ["Вам подходят следующие расписания:\n\n"]
+def _build_request(user_input):
+    """Тело запроса completion к Yandex GPT"""
+    prompt = PROMPT_TEMPLATE.replace("{user_input}", user_input.replace("{", "{{").replace("}", "}}"))
+
+    return {
+        "modelUri": MODEL_URI,
+        "completionOptions": {
+            "stream": False,
+            "temperature": 0.3,
+            "maxTokens": 1000
+        },
+        "messages": [{
+            "role": "user",
+            "text": prompt
+        }]
+    }
 
-        for i, schedule in enumerate(matched_schedules, 1):
-            subjects_info = []
-            for subject in schedule["предметы"]:
-                subject_str = f"{subject['название_предмета']} ({subject['группа']})"
-                if subject_str not in subjects_info:
-                    subjects_info.append(subject_str)
 
-            schedule_line = f"Расписание #{i}:\n"
-            schedule_line += f"• Предметы: {', '.join(subjects_info)}\n"
+def _parse_completion(result):
+    """Извлекает фильтры из ответа Yandex GPT"""
+    text = result['result']['alternatives'][0]['message']['text'].strip()
+    if not text:
+        raise ValueError("Пустой ответ от Yandex GPT API")
 
-            # Добавляем информацию о преподавателях
-            teachers_info = defaultdict(list)
-            for subject in schedule["предметы"]:
-                for cls in subject["занятия"]:
-                    for teacher in cls["преподаватели"]:
-                        if subject['название_предмета'] not in teachers_info[teacher]:
-                            teachers_info[teacher].append(subject['название_предмета'])
+    # Очистка ответа
+    text = text.strip('`').strip()
+    if text.startswith('json'):
+        text = text[4:].strip()
 
-            if teachers_info:
-                schedule_line += "• Преподаватели:\n"
-                for teacher, subjects in teachers_info.items():
-                    schedule_line += f"  - {teacher}: {', '.join(subjects)}\n"
+    return json.loads(text)
 
-            report_lines.append(schedule_line + "\n")
 
-        with open(output_file, 'w', encoding='utf-8') as f_out:
-            f_out.writelines(report_lines)
+def _fallback_filters(user_input):
+    """Фолбэк-режим для генерации фильтров: лучший локальный разбор запроса"""
+    filters, _ = parse_filters(user_input)
+    return filters
 
-        return output_file
 
-    except Exception as e:
-        logger.error(f"Ошибка генерации отчета: {e}")
-        return None
\ No newline at end of file
+def reset_cursor(user_id, filters_chain):
+    """Начинает новый постраничный поиск.
+
+    filters_chain — список наборов фильтров: расписание подходит, если
+    проходит каждый из них (так уточнения сужают прежний результат).
+    Зерно случайной выборки выводится из фильтров: на тот же запрос
+    показываются те же варианты.
+    """
+    payload = json.dumps(filters_chain, ensure_ascii=False, sort_keys=True)
+    write_json(f"{SESSIONS_DIR}/{user_id}/cursor.json", {
+        "filters": filters_chain,
+        "ranked": None,
+        "seed": int(hashlib.sha256(payload.encode('utf-8')).hexdigest()[:16], 16),
+        "draws": 0,
+        "queue": [],
+        "sampled": [],
+        "sampled_all": False,
+        "after": None,
+        "shown": 0,
+        "exhausted": False
+    })
+
+
+def next_page(user_id, limit):
+    """Достаёт из генератора следующую страницу подходящих расписаний.
+
+    Первыми показываются RANKED_TOP_K лучших по стоимости из пожеланий
+    (см. ranked_search), затем остальные подходящие — в порядке перебора,
+    без повторов. Если подходящих не меньше SAMPLE_MIN_COUNT, вместо
+    порядка перебора, который надолго застревает в вариантах с одними
+    и теми же первыми группами, они тянутся равномерной случайной
+    выборкой без повторов (см. sample_schedules); если выборка почти
+    ничего не находит, остальные подходящие показываются в порядке
+    перебора. Если не подходит ни одно расписание, последний набор
+    фильтров становится мягким и показываются RANKED_TOP_K наименее
+    нарушающих его расписаний; у таких расписаний в поле "нарушено"
+    перечислены невыполненные пожелания. Перебор продолжается с позиции,
+    сохранённой в курсоре сессии, так что непросмотренные страницы не
+    вычисляются. Возвращает развёрнутые расписания, число показанных
+    с начала поиска и признак исчерпания.
+    """
+    session_dir = f"{SESSIONS_DIR}/{user_id}"
+    cursor_file = f"{session_dir}/cursor.json"
+    cursor = load_json(cursor_file)
+    if cursor["exhausted"]:
+        return [], cursor["shown"], True
+
+    index = load_json(f"{session_dir}/index.json")
+    catalog = load_catalog(f"{session_dir}/catalog.json")
+
+    if cursor.get("ranked") is None:
+        _rank(cursor, index, catalog)
+
+    start = cursor["ranked_shown"]
+    found = cursor["ranked"][start:start + limit]
+    broken = cursor["broken"][start:start + limit]
+    cursor["ranked_shown"] += len(found)
+    exhausted = cursor["ranked_all"] and cursor["ranked_shown"] == len(cursor["ranked"])
+
+    if len(found) < limit and not exhausted:
+        next_matches = _next_sampled if cursor["sample"] or cursor["queue"] else _next_unranked
+        more, exhausted = next_matches(session_dir, index, catalog, cursor, limit - len(found))
+        found += more
+        broken += [[] for _ in more]
+
+    page = []
+    for team_indices, violations in zip(found, broken):
+        schedule = expand_schedule(catalog, team_indices)
+        if violations:
+            schedule["нарушено"] = violations
+        page.append(schedule)
+    cursor["shown"] += len(page)
+    cursor["exhausted"] = exhausted
+    write_json(cursor_file, cursor)
+
+    return page, cursor["shown"], exhausted
+
+
+def _rank(cursor, index, catalog):
+    """Находит лучшие расписания для курсора, при нуле совпадений — с мягким последним набором"""
+    ranked, complete = top_schedules(index, catalog, cursor["filters"], RANKED_TOP_K)
+    # Полный перебор нашёл меньше RANKED_TOP_K — других подходящих нет
+    cursor["ranked_all"] = complete and len(ranked) < RANKED_TOP_K
+
+    # Поиск, упёршийся в предел узлов, ничего не нашедший, тоже ведёт к
+    # объяснению и ближайшим расписаниям: подходящих может не быть вовсе
+    if not ranked:
+        cursor["diagnosis"] = diagnose_filters(index, catalog, cursor["filters"], known_empty=complete)
+
+    if not ranked and cursor["filters"] and cursor["filters"][-1]:
+        relaxed = cursor["filters"][:-1] + [relax_filters(cursor["filters"][-1])]
+        ranked, _ = top_schedules(index, catalog, relaxed, RANKED_TOP_K)
+        logger.info(f"Точных совпадений не найдено, показываются {len(ranked)} ближайших расписаний")
+        # После ближайших показывать нечего, если перебор был полным и точных совпадений нет;
+        # иначе дальше ищутся точные, как обычно
+        cursor["ranked_all"] = complete
+
+    cursor["ranked"] = [list(team_indices) for _, team_indices, _ in ranked]
+    cursor["broken"] = [violations for _, _, violations in ranked]
+    cursor["ranked_shown"] = 0
+
+    cursor["sample"] = False
+    if not cursor["ranked_all"]:
+        # Счётчик строится один раз на курсор: его число нужно count_matches,
+        # а сам он — первой порции выборки, которая ждёт в курсоре
+        counter = build_counter(index, compile_filters(catalog, cursor["filters"])["domains"])
+        cursor["bound"] = counter.total if counter is not None else None
+        cursor["sample"] = counter is not None and counter.total >= SAMPLE_MIN_COUNT
+        if cursor["sample"]:
+            _draw_samples(index, catalog, cursor, SAMPLE_BATCH, counter)
+
+
+def no_match_reasons(user_id):
+    """Почему под текущие фильтры не подошло ни одно расписание; пустой список, если подошли"""
+    cursor = load_json(f"{SESSIONS_DIR}/{user_id}/cursor.json", default={})
+    return cursor.get("diagnosis") or []
+
+
+def count_matches(user_id):
+    """Сколько всего расписаний и сколько из них проходят текущие фильтры.
+
+    Возвращает (всего, подходит, точно ли «подходит»); None вместо числа,
+    если его слишком долго считать. Результат запоминается в курсоре.
+    """
+    session_dir = f"{SESSIONS_DIR}/{user_id}"
+    cursor_file = f"{session_dir}/cursor.json"
+    cursor = load_json(cursor_file)
+    if "counts" not in cursor:
+        index = load_json(f"{session_dir}/index.json")
+        catalog = load_catalog(f"{session_dir}/catalog.json")
+        if cursor.get("ranked") is None:
+            _rank(cursor, index, catalog)
+        if cursor["ranked_all"]:
+            # Поиск лучших перебрал всё: подходящие — найденные им без нарушений
+            matched, exact = sum(1 for violations in cursor["broken"] if not violations), True
+        else:
+            matched, exact = count_matching(index, catalog, cursor["filters"], cursor["bound"])
+        cursor["counts"] = [load_count(user_id), matched, exact]
+        write_json(cursor_file, cursor)
+    return tuple(cursor["counts"])
+
+
+def load_count(user_id):
+    """Число валидных расписаний сессии; None, если оно неизвестно"""
+    count_file = f"{SESSIONS_DIR}/{user_id}/count.json"
+    return load_json(count_file) if os.path.exists(count_file) else None
+
+
+def load_diagnosis(user_id):
+    """Почему генерация не нашла ни одного расписания; пустой список, если причина неизвестна"""
+    return load_json(f"{SESSIONS_DIR}/{user_id}/diagnosis.json", default=[])
+
+
+def _next_unranked(session_dir, index, catalog, cursor, limit):
+    """Следующие limit подходящих расписаний в порядке перебора, кроме уже показанных лучших и выпавших в выборке.
+
+    Сдвигает позицию перебора в курсоре. Возвращает (комбинации, исчерпан ли перебор).
+    """
+    skip = set(map(tuple, cursor["ranked"] + cursor["sampled"]))
+    found = []
+    exhausted = False
+
+    if use_parallel_search(index):
+        while len(found) < limit and not exhausted:
+            batch, exhausted = search_page(
+                session_dir, index, catalog, cursor["filters"], limit - len(found), resume_after=cursor["after"]
+            )
+            if batch:
+                cursor["after"] = list(batch[-1])
+            found += [team_indices for team_indices in batch if tuple(team_indices) not in skip]
+        return found, exhausted
+
+    exhausted = True
+    for team_indices in _iter_matching(index, catalog, cursor["filters"], resume_after=cursor["after"]):
+        cursor["after"] = list(team_indices)
+        if tuple(team_indices) in skip:
+            continue
+        found.append(team_indices)
+        if len(found) >= limit:
+            exhausted = False
+            break
+    return found, exhausted
+
+
+def _next_sampled(session_dir, index, catalog, cursor, limit):
+    """Следующие limit подходящих расписаний из равномерной случайной выборки, кроме уже показанных лучших.
+
+    Берёт их из очереди курсора, пополняя её порцией выборки, когда
+    её не хватает. Когда выборка закончилась, не вытянув все номера,
+    остальные подходящие показываются в порядке перебора. Возвращает
+    (комбинации, исчерпаны ли подходящие).
+    """
+    if len(cursor["queue"]) < limit and cursor["sample"]:
+        _draw_samples(index, catalog, cursor, max(limit, SAMPLE_BATCH) - len(cursor["queue"]))
+
+    found = cursor["queue"][:limit]
+    del cursor["queue"][:limit]
+    cursor["sampled"] += found
+    if cursor["sampled_all"]:
+        return found, not cursor["queue"]
+    if len(found) < limit:
+        more, exhausted = _next_unranked(session_dir, index, catalog, cursor, limit - len(found))
+        return found + more, exhausted
+    return found, False
+
+
+def _draw_samples(index, catalog, cursor, count, counter=None):
+    """Тянет в очередь курсора до count новых расписаний случайной выборки.
+
+    Сдвигает число вытянутых номеров в курсоре. Если подходящие не
+    удалось сосчитать или за порцию нашлось меньше count (проверки целых
+    расписаний отбрасывают почти всё), курсор выходит из режима выборки.
+    """
+    ranked = set(map(tuple, cursor["ranked"]))
+    result = sample_schedules(
+        index, catalog, cursor["filters"], cursor["seed"], count,
+        draws=cursor["draws"], exclude=ranked, counter=counter
+    )
+    if result is None:
+        cursor["sample"] = False
+        return
+
+    found, cursor["draws"], drawn_all = result
+    cursor["queue"] += [list(team_indices) for team_indices in found]
+    if drawn_all:
+        cursor["sample"] = False
+        cursor["sampled_all"] = True
+    elif len(found) < count:
+        logger.info(f"Случайная выборка нашла {len(found)} подходящих за {cursor['draws']} номеров, дальше перебор")
+        cursor["sample"] = False
+
+
+def _iter_matching(index, catalog, filters_chain, resume_after=None):
+    """Перебирает компактные расписания, проходящие всю цепочку фильтров.
+
+    Маски групп из скомпилированного плана сужают домены генератора,
+    и перебор не заходит в заведомо неподходящие ветки; остальные
+    проверки плана выполняются на готовых комбинациях.
+    """
+    plan = compile_filters(catalog, filters_chain)
+    for team_indices in iter_assignments(index, resume_after, plan["domains"]):
+        if all(check(team_indices) for check in plan["checks"]):
+            yield team_indices
@@ -1,200 +1,363 @@
-import os
-import json
-import re
-import random
-import logging
-from collections import defaultdict
-from config import MAX_SCHEDULES, SESSIONS_DIR
-from utils import parse_time, normalize_day_name
-
-logger = logging.getLogger(__name__)
-
-
-def generate_schedules(user_id):
-    """Генерирует расписания для пользователя"""
-    logger.info(f"Начало генерации расписаний для пользователя {user_id}")
-    input_dir = f"{SESSIONS_DIR}/{user_id}/input_schedules"
-    output_file = f"{SESSIONS_DIR}/{user_id}/schedules.json"
-
-    if not os.path.exists(input_dir):
-        logger.error(f"Директория не существует: {input_dir}")
-        return 0
-
-    subject_teams = defaultdict(lambda: defaultdict(list))
-    file_count = 0
-
-    for filename in os.listdir(input_dir):
-        if filename.endswith(".json"):
-            file_count += 1
-            json_file = os.path.join(input_dir, filename)
-            logger.info(f"Обработка файла: {json_file}")
-
-            try:
-                with open(json_file, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    subject_name = os.path.splitext(filename)[0]
-
-                    for lesson in data:
-                        # Проверка обязательных полей
-                        if 'день' not in lesson or 'команда' not in lesson:
-                            logger.warning(f"Пропущен урок без дня или команды в {filename}")
-                            continue
-
-                        lesson['день'] = normalize_day_name(lesson['день'])
-                        team = lesson['команда']
-
-                        # Добавляем название предмета в урок
-                        lesson['предмет'] = subject_name
-                        subject_teams[subject_name][team].append(lesson)
-
-                logger.info(f"Файл {filename} обработан: {len(data)} уроков")
-            except Exception as e:
-                logger.error(f"Ошибка обработки файла {filename}: {e}")
-
-    logger.info(f"Обработано файлов: {file_count}, предметов: {len(subject_teams)}")
-
-    if not subject_teams:
-        return 0
-
-    try:
-        schedules = _generate_valid_schedules(subject_teams)
-        logger.info(f"Найдено валидных расписаний: {len(schedules)}")
-
-        saved_count = _save_schedules_to_json(schedules, output_file, MAX_SCHEDULES)
-        logger.info(f"Сохранено расписаний: {saved_count}")
-        return saved_count
-    except Exception as e:
-        logger.error(f"Ошибка генерации: {e}")
-        return 0
-
-
-def _generate_valid_schedules(subject_teams):
-    """Генерирует валидные расписания с оптимизацией"""
-    if not subject_teams:
-        return []
-
-    subjects = list(subject_teams.keys())
-    valid_schedules = []
-    schedule_count = 0
-    max_attempts = MAX_SCHEDULES * 10
-
-    logger.info(f"Генерация расписаний для {len(subjects)} предметов")
-
-    for attempt in range(max_attempts):
-        all_lessons = []
-        schedule_info = []
-        valid = True
-
-        for subject in subjects:
-            teams = list(subject_teams[subject].items())
-            if not teams:
-                valid = False
-                break
-
-            team, lessons = random.choice(teams)
-            all_lessons.extend(lessons)
-            schedule_info.append((subject, team))
-
-        if not valid:
-            continue
-
-        if _validate_full_schedule(all_lessons):
-            valid_schedules.append((schedule_info, all_lessons))
-            schedule_count += 1
-
-            if schedule_count >= MAX_SCHEDULES:
-                logger.info(f"Достигнут лимит после {attempt + 1} попыток")
-                break
-
-    logger.info(f"Сгенерировано расписаний: {len(valid_schedules)}")
-    return valid_schedules
-
-
-def _validate_full_schedule(lessons):
-    """Проверяет полное расписание на пересечения"""
-    day_lessons = defaultdict(list)
-
-    for lesson in lessons:
-        day = lesson.get('день', '')
-        day_lessons[day].append(lesson)
-
-    for day, day_list in day_lessons.items():
-        if not _validate_day_schedule(day_list):
-            return False
-
-    return True
-
-
-def _validate_day_schedule(lessons):
-    """Проверяет расписание на один день"""
-    lessons.sort(key=lambda x: parse_time(x.get('Место и время', '')) or ((0, 0), (0, 0)))
-
-    prev_end = 0
-    for lesson in lessons:
-        time_range = parse_time(lesson.get('Место и время', ''))
-        if not time_range:
-            continue
-
-        (start_hour, start_min), (end_hour, end_min) = time_range
-        start_time = start_hour * 60 + start_min
-        end_time = end_hour * 60 + end_min
-
-        if start_time < prev_end:
-            return False
-
-        prev_end = end_time
-
-    return True
-
-
-def _save_schedules_to_json(valid_schedules, output_file, max_schedules):
-    """Сохраняет расписания в JSON"""
-    if not valid_schedules:
-        return 0
-
-    schedules_to_save = valid_schedules[:max_schedules]
-    output_data = []
-
-    for i, (schedule_info, all_lessons) in enumerate(schedules_to_save, 1):
-        schedule_data = {"id_расписания": i, "предметы": []}
-        subject_lessons = defaultdict(list)
-
-        for lesson in all_lessons:
-            key = (lesson.get('предмет', ''), lesson.get('команда', ''))
-            subject_lessons[key].append(lesson)
-
-        for (subject, team), lessons in subject_lessons.items():
-            subject_data = {
-                "название_предмета": subject,
-                "группа": team,
-                "занятия": []
-            }
-
-            for lesson in lessons:
-                time_str = lesson.get('Место и время', '')
-                time_val = ""
-                location = ""
-
-                if time_str:
-                    match = re.search(r'\d{1,2}:\d{2}–\d{1,2}:\d{2}', time_str)
-                    if match:
-                        time_val = match.group(0)
-                        location = time_str.replace(time_val, '').strip()
-
-                lesson_data = {
-                    "тип_занятия": lesson.get('тип занятия', ''),
-                    "день": lesson.get('день', ''),
-                    "время": time_val,
-                    "преподаватели": lesson.get('преподаватели', []),
-                    "аудитория": location
-                }
-                subject_data["занятия"].append(lesson_data)
-
-            schedule_data["предметы"].append(subject_data)
-
-        output_data.append(schedule_data)
-
-    with open(output_file, 'w', encoding='utf-8') as f:
-        json.dump(output_data, f, ensure_ascii=False, indent=4)
-
-    return len(schedules_to_save)
\ No newline at end of file
+import os
+import json
+import hashlib
+import logging
+from config import SESSIONS_DIR
+from schedule_store import write_json, load_json, load_catalog
+from schedule_model import Catalog
+from lesson_ingest import WEEKDAYS, ingest_lessons
+from parsed_cache import cache_get, cache_put
+from result_store import result_key, restore_result, store_result
+from schedule_count import count_schedules
+
+logger = logging.getLogger(__name__)
+
+# Шаг сетки для битовых масок занятости
+SLOT_MINUTES = 5
+SLOTS_PER_DAY = 24 * 60 // SLOT_MINUTES
+
+# Фиксированное место дней недели в маске занятости
+WEEKDAY_OFFSETS = {day: i * SLOTS_PER_DAY for i, day in enumerate(WEEKDAYS)}
+
+
+def generate_schedules(user_id):
+    """Готовит перебор расписаний для пользователя.
+
+    Сами расписания не материализуются: сохраняются каталог занятий
+    и индекс для поиска, а страницы перебираются лениво. Разобранные
+    предметы и таблицы совместимости пар предметов берутся из общего
+    кэша по хэшу содержимого файлов, поэтому после добавления, удаления
+    или замены одного файла пересчитывается только то, что его касается,
+    а одинаковые файлы разных пользователей разбираются один раз. Если
+    точно такой же набор файлов уже генерировался, готовый результат
+    берётся из общего хранилища целиком. Точное число валидных
+    расписаний сохраняется в count.json сессии (null, если их слишком
+    много, чтобы быстро сосчитать).
+    Возвращает True, если существует хотя бы одно валидное расписание.
+    """
+    logger.info(f"Начало генерации расписаний для пользователя {user_id}")
+    session_dir = f"{SESSIONS_DIR}/{user_id}"
+    input_dir = f"{session_dir}/input_schedules"
+
+    # Курсор постраничного поиска и разбор неудачи относятся к прежнему индексу,
+    # даже если новая генерация не дойдёт до построения своего
+    for stale_file in (f"{session_dir}/cursor.json", f"{session_dir}/diagnosis.json"):
+        try:
+            os.remove(stale_file)
+        except FileNotFoundError:
+            pass
+
+    if not os.path.exists(input_dir):
+        logger.error(f"Директория не существует: {input_dir}")
+        return False
+
+    subjects = []
+    file_count = 0
+
+    for filename in sorted(os.listdir(input_dir)):
+        if filename.endswith(".json"):
+            file_count += 1
+            subject = _load_subject(os.path.join(input_dir, filename))
+            # Файл без единого корректного занятия предмета не добавляет
+            if subject is not None and subject["has_lessons"]:
+                subjects.append((os.path.splitext(filename)[0], subject))
+
+    logger.info(f"Обработано файлов: {file_count}, предметов: {len(subjects)}")
+
+    if not subjects:
+        return False
+
+    try:
+        key = result_key(subjects)
+        found = restore_result(key, session_dir)
+        if found is None:
+            found = _build_session(session_dir, subjects)
+            store_result(key, session_dir, found)
+        else:
+            logger.info("Такой набор файлов уже генерировался, результат взят из хранилища")
+
+        logger.info(f"Валидные расписания {'найдены' if found else 'не найдены'}")
+        if not found:
+            _write_diagnosis(session_dir)
+        return found
+    except Exception as e:
+        logger.error(f"Ошибка генерации: {e}")
+        return False
+
+
+def _build_session(session_dir, subjects):
+    """Строит и сохраняет индекс, каталог и число расписаний сессии; True, если есть хотя бы одно расписание"""
+    index = _build_index(subjects)
+    catalog = _build_catalog(subjects)
+    write_json(f"{session_dir}/catalog.json", catalog)
+    write_json(f"{session_dir}/index.json", index)
+
+    count = count_schedules(index)
+    write_json(f"{session_dir}/count.json", count)
+    if count is not None:
+        logger.info(f"Валидных расписаний: {count}")
+        return count > 0
+
+    # Импорт здесь: parallel_search сам опирается на iter_assignments
+    from parallel_search import use_parallel_search, search_page
+    if use_parallel_search(index):
+        return bool(search_page(session_dir, index, Catalog.from_json(catalog), [], 1)[0])
+    return next(iter_assignments(index), None) is not None
+
+
+def _write_diagnosis(session_dir):
+    """Сохраняет объяснение, почему не сложилось ни одного расписания"""
+    # Импорт здесь: diagnosis сам опирается на iter_assignments
+    from diagnosis import diagnose_schedules
+    try:
+        index = load_json(f"{session_dir}/index.json")
+        lines = diagnose_schedules(index, load_catalog(f"{session_dir}/catalog.json"))
+        write_json(f"{session_dir}/diagnosis.json", lines)
+    except Exception as e:
+        logger.error(f"Ошибка диагностики: {e}")
+
+
+def _load_subject(path):
+    """Разобранный файл предмета: из общего кэша по хэшу содержимого или заново"""
+    filename = os.path.basename(path)
+    try:
+        with open(path, 'rb') as f:
+            content = f.read()
+        content_hash = hashlib.sha256(content).hexdigest()
+        subject = cache_get("subjects", content_hash)
+        if subject is not None:
+            logger.info(f"Файл {filename} уже разобран, разбор взят из кэша")
+            return subject
+
+        logger.info(f"Обработка файла: {path}")
+        data = json.loads(content.decode('utf-8-sig'))
+        subject = _parse_subject(data, filename)
+        subject["hash"] = content_hash
+        cache_put("subjects", content_hash, subject)
+        logger.info(f"Файл {filename} обработан: {len(data)} уроков")
+        return subject
+    except Exception as e:
+        logger.error(f"Ошибка обработки файла {filename}: {e}")
+        return None
+
+
+def _parse_subject(data, filename):
+    """Группирует записи занятий файла по группам и переводит их в интервалы слотов.
+
+    Группа с пересечениями внутри себя не войдёт ни в одно расписание,
+    поэтому отбрасывается сразу.
+    """
+    subject_teams = ingest_lessons(data, filename)
+
+    teams = []
+    lessons = []
+    intervals = []
+    for team in sorted(subject_teams, key=str):
+        team_intervals = _team_intervals(subject_teams[team])
+        if team_intervals is None:
+            logger.warning(f"Группа {team} в {filename} пересекается сама с собой")
+            continue
+        teams.append(team)
+        lessons.append(subject_teams[team])
+        intervals.append(team_intervals)
+
+    # Маски на фиксированной сетке недели годятся для любого набора предметов;
+    # с нестандартными названиями дней они считаются при сборке индекса
+    canonical = all(day in WEEKDAY_OFFSETS for team_intervals in intervals for day, _, _ in team_intervals)
+
+    return {
+        "teams": teams,
+        "lessons": lessons,
+        "intervals": intervals,
+        "masks": [_intervals_mask(team_intervals, dict(WEEKDAY_OFFSETS)) for team_intervals in intervals]
+        if canonical else None,
+        "has_lessons": bool(subject_teams)
+    }
+
+
+def _team_intervals(lessons):
+    """Занятые слоты группы [день, первый слот, слот после конца], None — если они пересекаются"""
+    intervals = sorted(
+        interval for interval in map(_lesson_interval, lessons) if interval is not None
+    )
+    for previous, current in zip(intervals, intervals[1:]):
+        if previous[0] == current[0] and current[1] < previous[2]:
+            return None
+    return [list(interval) for interval in intervals]
+
+
+def _lesson_interval(lesson):
+    """Интервал занятия в SLOT_MINUTES-минутных слотах дня"""
+    if lesson["начало"] is None:
+        return None
+    start_slot = lesson["начало"] // SLOT_MINUTES
+    end_slot = -(-lesson["конец"] // SLOT_MINUTES)
+    return lesson["день"], start_slot, end_slot
+
+
+def _build_index(subjects):
+    """Компилирует группы в битовые маски занятости и таблицу совместимости.
+
+    compatible[i][a][j] — битовая маска групп предмета j, которые не
+    пересекаются с группой a предмета i. Строки для каждой пары предметов
+    берутся из кэша по хэшам их файлов.
+    """
+    day_offsets = dict(WEEKDAY_OFFSETS)
+    masks = [_subject_masks(subject, day_offsets) for _, subject in subjects]
+
+    compatible = [[[0] * len(subjects) for _ in subject_masks] for subject_masks in masks]
+    computed = 0
+    for i, (_, subject_a) in enumerate(subjects):
+        for j in range(i + 1, len(subjects)):
+            rows, cached = _pair_rows(subject_a, subjects[j][1])
+            computed += not cached
+            for a, row in enumerate(rows):
+                compatible[i][a][j] = row
+                while row:
+                    lowest = row & -row
+                    row ^= lowest
+                    compatible[j][lowest.bit_length() - 1][i] |= 1 << a
+    logger.info(f"Таблиц совместимости пересчитано: {computed}")
+
+    return {
+        "subjects": [name for name, _ in subjects],
+        "teams": [subject["teams"] for _, subject in subjects],
+        "masks": masks,
+        "compatible": compatible
+    }
+
+
+def _pair_rows(subject_a, subject_b):
+    """Строки совместимости групп subject_a с группами subject_b.
+
+    Зависят только от содержимого двух файлов. Возвращает (строки, взяты ли из кэша).
+    """
+    # Совместимость симметрична: в кэше лежат строки файла с меньшим хэшем,
+    # так что запись одна при любом порядке предметов
+    if subject_a["hash"] > subject_b["hash"]:
+        rows, cached = _pair_rows(subject_b, subject_a)
+        return _transpose(rows, len(subject_a["teams"])), cached
+
+    key = f"{subject_a['hash']}_{subject_b['hash']}"
+    rows = cache_get("pairs", key)
+    if rows is not None:
+        return rows, True
+
+    day_offsets = dict(WEEKDAY_OFFSETS)
+    masks_a = _subject_masks(subject_a, day_offsets)
+    masks_b = _subject_masks(subject_b, day_offsets)
+    rows = []
+    for mask_a in masks_a:
+        row = 0
+        for b, mask_b in enumerate(masks_b):
+            if not mask_a & mask_b:
+                row |= 1 << b
+        rows.append(row)
+
+    cache_put("pairs", key, rows)
+    return rows, False
+
+
+def _transpose(rows, width):
+    """Строки совместимости в обратную сторону: width — число групп в новых строках"""
+    transposed = [0] * width
+    for b, row in enumerate(rows):
+        while row:
+            lowest = row & -row
+            row ^= lowest
+            transposed[lowest.bit_length() - 1] |= 1 << b
+    return transposed
+
+
+def _subject_masks(subject, day_offsets):
+    """Маски групп предмета: заранее посчитанные или по интервалам"""
+    if subject.get("masks") is not None:
+        return subject["masks"]
+    return [_intervals_mask(team_intervals, day_offsets) for team_intervals in subject["intervals"]]
+
+
+def _intervals_mask(intervals, day_offsets):
+    """Маска занятости: по биту на каждый SLOT_MINUTES-минутный слот недели"""
+    mask = 0
+    for day, start_slot, end_slot in intervals:
+        if day not in day_offsets:
+            day_offsets[day] = len(day_offsets) * SLOTS_PER_DAY
+        mask |= ((1 << (end_slot - start_slot)) - 1) << (day_offsets[day] + start_slot)
+    return mask
+
+
+def iter_assignments(index, resume_after=None, domains=None):
+    """Перебирает все валидные комбинации групп, каждую ровно один раз.
+
+    Поиск в глубину: следующим берётся предмет с наименьшим числом ещё
+    совместимых групп, после выбора группы домены остальных предметов
+    сужаются по таблице совместимости, и ветка отсекается, как только
+    у какого-то предмета не остаётся вариантов. Комбинация — кортеж
+    индексов групп в порядке index["subjects"].
+
+    Порядок обхода детерминирован, поэтому перебор можно продолжить
+    с места остановки: resume_after — последняя уже выданная комбинация.
+    domains — необязательные маски допустимых групп каждого предмета,
+    которыми фильтры сужают перебор до его начала.
+    """
+    compatible = index["compatible"]
+    assignment = [None] * len(index["subjects"])
+
+    def search(domains, unassigned, following):
+        if not unassigned:
+            if not following:
+                yield tuple(assignment)
+            return
+
+        current = min(unassigned, key=lambda i: domains[i].bit_count())
+        rest = [i for i in unassigned if i != current]
+        domain = domains[current]
+        if following:
+            # Группы левее курсора на этом пути уже были перебраны
+            domain &= ~((1 << resume_after[current]) - 1)
+        while domain:
+            lowest = domain & -domain
+            domain ^= lowest
+            team = lowest.bit_length() - 1
+            row = compatible[current][team]
+            narrowed = list(domains)
+            for other in rest:
+                narrowed[other] &= row[other]
+                if not narrowed[other]:
+                    break
+            else:
+                assignment[current] = team
+                yield from search(narrowed, rest, following and team == resume_after[current])
+        assignment[current] = None
+
+    full_domains = [(1 << len(team_names)) - 1 for team_names in index["teams"]]
+    if domains is None:
+        domains = full_domains
+    else:
+        domains = [domain & full for domain, full in zip(domains, full_domains)]
+    if all(domains):
+        yield from search(domains, list(range(len(domains))), resume_after is not None)
+
+
+def _build_catalog(subjects):
+    """Собирает каталог: занятия каждой группы каждого предмета хранятся один раз.
+
+    Расписание ссылается на каталог кортежем индексов групп в порядке
+    index["subjects"].
+    """
+    catalog = {"предметы": []}
+
+    for name, subject in subjects:
+        catalog["предметы"].append({
+            "название_предмета": name,
+            "группы": [
+                {
+                    "группа": team,
+                    "занятия": lessons
+                }
+                for team, lessons in zip(subject["teams"], subject["lessons"])
+            ]
+        })
+
+    return catalog
+
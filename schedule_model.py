@@ -0,0 +1,167 @@
+import sys
+
+from lesson_ingest import format_time_range
+
+
+def _intern(value):
+    """Одинаковые строки (преподаватели, аудитории, дни) хранятся одним объектом"""
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+class _Frozen:
+    """Запрещает изменять объект после создания"""
+    __slots__ = ()
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} нельзя изменять")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"{type(self).__name__} нельзя изменять")
+
+
+class Lesson(_Frozen):
+    """Занятие группы: разобранная запись каталога.
+
+    start и end — минуты от начала дня (None, если время не распознано),
+    weekday — номер дня недели (None для нестандартного названия дня).
+    """
+    __slots__ = ("kind", "day", "weekday", "start", "end", "teachers", "room", "_hash")
+
+    def __init__(self, kind, day, weekday, start, end, teachers, room):
+        fields = (_intern(kind), _intern(day), weekday, start, end, tuple(map(_intern, teachers)), _intern(room))
+        for name, value in zip(Lesson.__slots__, fields):
+            object.__setattr__(self, name, value)
+        object.__setattr__(self, "_hash", hash(fields))
+
+    @classmethod
+    def from_record(cls, record):
+        """Занятие из записи каталога (см. lesson_ingest)"""
+        return cls(
+            record["тип_занятия"], record["день"], record["день_недели"],
+            record["начало"], record["конец"], record["преподаватели"], record["аудитория"]
+        )
+
+    def to_record(self):
+        """Запись каталога в прежнем JSON-формате"""
+        return {
+            "тип_занятия": self.kind,
+            "день": self.day,
+            "день_недели": self.weekday,
+            "начало": self.start,
+            "конец": self.end,
+            "время": format_time_range(self.start, self.end),
+            "преподаватели": list(self.teachers),
+            "аудитория": self.room
+        }
+
+    def _fields(self):
+        return self.kind, self.day, self.weekday, self.start, self.end, self.teachers, self.room
+
+    def __eq__(self, other):
+        if not isinstance(other, Lesson):
+            return NotImplemented
+        return self is other or (self._hash == other._hash and self._fields() == other._fields())
+
+    def __hash__(self):
+        return self._hash
+
+    def __repr__(self):
+        return f"Lesson({self.day}, {self.start}-{self.end}, {self.kind!r})"
+
+
+class Team(_Frozen):
+    """Группа предмета и её занятия"""
+    __slots__ = ("subject", "name", "lessons")
+
+    def __init__(self, subject, name, lessons):
+        object.__setattr__(self, "subject", _intern(subject))
+        object.__setattr__(self, "name", _intern(name))
+        object.__setattr__(self, "lessons", tuple(lessons))
+
+    def __repr__(self):
+        return f"Team({self.subject!r}, {self.name!r})"
+
+
+class Schedule(_Frozen):
+    """Расписание: по группе каждого предмета каталога.
+
+    Равенство и хэш считаются по кортежу индексов групп, поэтому
+    расписания дёшево складывать в множества и словари.
+    """
+    __slots__ = ("key", "teams")
+
+    def __init__(self, key, teams):
+        object.__setattr__(self, "key", tuple(key))
+        object.__setattr__(self, "teams", tuple(teams))
+
+    def to_json(self):
+        """Развёрнутое расписание в прежнем формате {"предметы": [...]}"""
+        return {"предметы": [
+            {
+                "название_предмета": team.subject,
+                "группа": team.name,
+                "занятия": [lesson.to_record() for lesson in team.lessons]
+            }
+            for team in self.teams
+        ]}
+
+    def __eq__(self, other):
+        if not isinstance(other, Schedule):
+            return NotImplemented
+        return self.key == other.key
+
+    def __hash__(self):
+        return hash(self.key)
+
+    def __repr__(self):
+        return f"Schedule({self.key})"
+
+
+class Catalog(_Frozen):
+    """Каталог сессии: группы каждого предмета в порядке index["subjects"].
+
+    Одинаковые занятия (например, общая лекция всех групп потока)
+    хранятся одним объектом.
+    """
+    __slots__ = ("subjects", "teams")
+
+    def __init__(self, subjects, teams):
+        object.__setattr__(self, "subjects", tuple(map(_intern, subjects)))
+        object.__setattr__(self, "teams", tuple(tuple(subject_teams) for subject_teams in teams))
+
+    @classmethod
+    def from_json(cls, catalog):
+        """Каталог из JSON-формата catalog.json"""
+        lessons = {}
+        subjects = []
+        teams = []
+        for subject in catalog["предметы"]:
+            name = subject["название_предмета"]
+            subjects.append(name)
+            teams.append([
+                Team(name, team["группа"], [
+                    lessons.setdefault(lesson, lesson)
+                    for lesson in map(Lesson.from_record, team["занятия"])
+                ])
+                for team in subject["группы"]
+            ])
+        return cls(subjects, teams)
+
+    def to_json(self):
+        """Каталог в JSON-формате catalog.json"""
+        return {"предметы": [
+            {
+                "название_предмета": subject,
+                "группы": [
+                    {"группа": team.name, "занятия": [lesson.to_record() for lesson in team.lessons]}
+                    for team in subject_teams
+                ]
+            }
+            for subject, subject_teams in zip(self.subjects, self.teams)
+        ]}
+
+    def schedule(self, team_indices):
+        """Расписание по кортежу индексов групп"""
+        return Schedule(team_indices, (
+            subject_teams[team] for subject_teams, team in zip(self.teams, team_indices)
+        ))
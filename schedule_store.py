@@ -0,0 +1,43 @@
+import os
+import json
+import logging
+import threading
+
+from schedule_model import Catalog
+
+logger = logging.getLogger(__name__)
+
+
+def write_json(path, data):
+    """Атомарно сохраняет JSON-документ (каталог, индекс, курсор, запись кэша).
+
+    Временный файл уникален для процесса и потока, поэтому одновременная
+    запись одного и того же документа из разных процессов безопасна.
+    """
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def load_json(path, default=None):
+    """Загружает JSON-документ сессии, default — если файла нет"""
+    if default is not None and not os.path.exists(path):
+        return default
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def load_catalog(path):
+    """Загружает каталог сессии в компактную неизменяемую модель"""
+    return Catalog.from_json(load_json(path))
+
+
+def expand_schedule(catalog, team_indices):
+    """Восстанавливает полное расписание в JSON-формате по индексам групп из каталога"""
+    return catalog.schedule(team_indices).to_json()
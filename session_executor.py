@@ -0,0 +1,89 @@
+import asyncio
+import logging
+import functools
+import weakref
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from config import SESSION_IO_WORKERS, SESSION_SEARCH_WORKERS
+
+logger = logging.getLogger(__name__)
+
+# Общий ограниченный пул для блокирующей работы с файлами сессий
+_executor = ThreadPoolExecutor(max_workers=SESSION_IO_WORKERS, thread_name_prefix="session-io")
+
+# Пул процессов для вычислений над сессией: в потоках они держали бы GIL и тормозили цикл событий
+_search_executor = None
+
+# Замок на пользователя живёт, пока его кто-то ждёт или держит
+_user_locks = weakref.WeakValueDictionary()
+
+
+def _user_lock(user_id):
+    lock = _user_locks.get(user_id)
+    if lock is None:
+        lock = asyncio.Lock()
+        _user_locks[user_id] = lock
+    return lock
+
+
+def _get_search_executor():
+    global _search_executor
+    if _search_executor is None:
+        # forkserver не наследует потоки и цикл событий бота, spawn — запасной вариант
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+        _search_executor = ProcessPoolExecutor(max_workers=SESSION_SEARCH_WORKERS, mp_context=context)
+    return _search_executor
+
+
+async def _run_locked(user_id, executor, call):
+    lock = _user_lock(user_id)
+    await lock.acquire()
+    try:
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(executor, call)
+    except BaseException:
+        lock.release()
+        raise
+    future.add_done_callback(lambda _: lock.release())
+    return await asyncio.shield(future)
+
+
+async def run_for_user(user_id, func, *args, **kwargs):
+    """Выполняет блокирующую функцию в пуле, не останавливая цикл событий.
+
+    Операции одного пользователя выполняются строго по очереди, так что
+    очистка сессии не пересечётся с фильтрацией в той же папке, а
+    операции разных пользователей идут параллельно в пределах пула.
+    Отмена ожидающего (например, по таймауту) не прерывает уже запущенную
+    функцию, и очередь пользователя освобождается только после её конца.
+    """
+    return await _run_locked(user_id, _executor, functools.partial(func, *args, **kwargs))
+
+
+async def run_search_for_user(user_id, func, *args, **kwargs):
+    """Как run_for_user, но для тяжёлых вычислений: функция выполняется в пуле процессов.
+
+    Очередь пользователя общая с run_for_user. func и аргументы должны
+    передаваться между процессами (функции уровня модуля, простые данные).
+    """
+    global _search_executor
+    executor = _get_search_executor()
+    try:
+        return await _run_locked(user_id, executor, functools.partial(func, *args, **kwargs))
+    except BrokenProcessPool:
+        # Процесс пула упал: следующий вызов получит новый пул
+        if _search_executor is executor:
+            logger.error("Пул вычислений над сессиями сломан и будет пересоздан")
+            _search_executor = None
+            executor.shutdown(wait=False, cancel_futures=True)
+        raise
+
+
+def shutdown_executor():
+    """Останавливает пулы, отменяя ещё не начатые задачи"""
+    _executor.shutdown(wait=False, cancel_futures=True)
+    if _search_executor is not None:
+        _search_executor.shutdown(wait=False, cancel_futures=True)
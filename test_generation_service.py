@@ -0,0 +1,49 @@
+import time
+import asyncio
+
+import pytest
+
+from generation_service import GenerationService, GenerationCancelled
+
+
+def _generate(user_id):
+    return user_id
+
+
+def _hang(user_id):
+    time.sleep(60)
+    return True
+
+
+async def _started(service, user_id):
+    while user_id not in service._running or service._running[user_id].process is None:
+        await asyncio.sleep(0.01)
+
+
+def test_run_returns_result():
+    async def scenario():
+        service = GenerationService(workers=1, queue_size=2, timeout=30, generate=_generate)
+        return await asyncio.wait_for(service.run(42), 30)
+
+    assert asyncio.run(scenario()) == 42
+
+
+def test_cancel_running_with_queued_job():
+    async def scenario():
+        service = GenerationService(workers=1, queue_size=2, timeout=60, generate=_hang)
+        first = asyncio.create_task(service.run(42))
+        second = asyncio.create_task(service.run(43))
+        await _started(service, 42)
+
+        # Отмена должна дождаться процесса, а не зависнуть, и освободить место следующему
+        assert await asyncio.wait_for(service.cancel(42), 10)
+        with pytest.raises(GenerationCancelled):
+            await first
+        await asyncio.wait_for(_started(service, 43), 10)
+
+        assert await asyncio.wait_for(service.cancel(43), 10)
+        with pytest.raises(GenerationCancelled):
+            await second
+        assert not await service.cancel(43)
+
+    asyncio.run(scenario())
@@ -0,0 +1,75 @@
+import pytest
+
+from filter_plan import compile_filters, compile_cost, compile_soft, SOFT_COST
+from ranked_search import top_schedules
+
+FILTER_CHAINS = [
+    [{"exclude_days": ["среда"]}],
+    [{"preferred_teachers": ["Иванов"]}],
+    [{"no_gaps": True}],
+    [{"preferred_start_time": "10:00"}],
+    [{"no_gaps": True, "soft": {"no_gaps": 2}}],
+    [{"exclude_days": ["вторник"], "max_classes_per_day": {"понедельник": 1}, "soft": ["exclude_days"]}],
+]
+
+
+def _cost(cost, soft, combo):
+    """Стоимость готового расписания по определению модели стоимости, без оценок"""
+    days = {}
+    total = 0
+    for subject, team in enumerate(combo):
+        team_days, penalty = cost["teams"][subject][team]
+        total += penalty
+        for day, (first, last, busy) in team_days.items():
+            if day in days:
+                old_first, old_last, old_busy = days[day]
+                days[day] = (min(first, old_first), max(last, old_last), busy + old_busy)
+            else:
+                days[day] = (first, last, busy)
+
+    total += cost["day_cost"] * len(days)
+    for first, last, busy in days.values():
+        total += cost["gap_cost"] * max(last - first - busy, 0)
+        if first < cost["start"]:
+            total += cost["early_cost"] * (cost["start"] - first)
+
+    violated = []
+    for constraint in soft:
+        kept = all(constraint["domains"][subject] >> team & 1 for subject, team in enumerate(combo))
+        if not (kept and all(check(combo) for check in constraint["checks"])):
+            total += SOFT_COST * constraint["weight"]
+            violated.append(constraint["description"])
+    return total, violated
+
+
+@pytest.mark.parametrize("filters_chain", FILTER_CHAINS)
+@pytest.mark.parametrize("k", [1, 5])
+def test_top_schedules_match_brute_force(random_session, all_assignments, filters_chain, k):
+    for seed in range(15):
+        index, catalog = random_session(seed, 5, 4)
+        plan = compile_filters(catalog, filters_chain)
+        cost = compile_cost(catalog, filters_chain)
+        soft = compile_soft(catalog, filters_chain)
+        matching = [
+            combo for combo in all_assignments(index, plan["domains"])
+            if all(check(combo) for check in plan["checks"])
+        ]
+        expected = sorted(_cost(cost, soft, combo)[0] for combo in matching)[:k]
+
+        ranked, complete = top_schedules(index, catalog, filters_chain, k, node_limit=10 ** 6)
+        assert complete
+        # Отсечение по нижней оценке не должно терять ни одного из лучших
+        assert [total for total, _, _ in ranked] == expected
+        for total, combo, violated in ranked:
+            assert combo in matching
+            assert _cost(cost, soft, combo) == (total, violated)
+
+
+def test_node_limit_reports_incomplete(random_session, all_assignments):
+    index, catalog = random_session(0, 5, 4)
+    assert len(all_assignments(index)) > 1
+
+    # В субботу занятий нет: фильтр пропускает все расписания
+    ranked, complete = top_schedules(index, catalog, [{"exclude_days": ["суббота"]}], 5, node_limit=2)
+    assert not complete
+    assert len(ranked) <= 5
@@ -0,0 +1,96 @@
+import random
+
+import pytest
+
+from filter_plan import compile_filters
+from schedule_count import SearchTreeCounter, count_schedules, count_matching, sample_schedules
+
+FILTER_CHAINS = [
+    [{"exclude_days": ["среда"]}],
+    [{"preferred_teachers": ["Иванов", "Петров"]}],
+    [{"no_gaps": True}],
+    [{"preferred_start_time": "10:00"}],
+    [{"max_classes_per_day": {"понедельник": 1, "вторник": 1}}],
+    [{"exclude_days": ["понедельник"]}, {"no_gaps": True}],
+]
+
+
+def _cases():
+    rnd = random.Random(1)
+    for seed in range(60):
+        yield seed, rnd.randint(1, 6), rnd.randint(1, 4)
+
+
+def _matching(catalog, assignments, filters_chain):
+    plan = compile_filters(catalog, filters_chain)
+    return [
+        combo for combo in assignments
+        if all(plan["domains"][subject] >> team & 1 for subject, team in enumerate(combo))
+        and all(check(combo) for check in plan["checks"])
+    ]
+
+
+@pytest.mark.parametrize("seed,subjects,teams", list(_cases()))
+def test_counter_matches_brute_force(random_session, all_assignments, seed, subjects, teams):
+    index, _ = random_session(seed, subjects, teams)
+    rnd = random.Random(seed)
+    domains = [rnd.randint(1, (1 << teams) - 1) if rnd.random() < 0.3 else (1 << teams) - 1 for _ in range(subjects)]
+
+    assert SearchTreeCounter(index).total == len(all_assignments(index))
+    assert SearchTreeCounter(index, domains).total == len(all_assignments(index, domains))
+
+
+@pytest.mark.parametrize("seed,subjects,teams", list(_cases()))
+def test_unrank_is_bijection(random_session, all_assignments, seed, subjects, teams):
+    index, _ = random_session(seed, subjects, teams)
+    counter = SearchTreeCounter(index)
+
+    unranked = [counter.unrank(rank) for rank in range(counter.total)]
+    assert sorted(unranked) == sorted(all_assignments(index))
+    with pytest.raises(IndexError):
+        counter.unrank(counter.total)
+
+
+def test_counter_stops_at_node_limit(random_session):
+    index, _ = random_session(0, 8, 4)
+    assert count_schedules(index, node_limit=1) is None
+
+
+@pytest.mark.parametrize("filters_chain", FILTER_CHAINS)
+def test_count_matching_matches_enumeration(random_session, all_assignments, filters_chain):
+    for seed in range(20):
+        index, catalog = random_session(seed, 5, 4)
+        expected = len(_matching(catalog, all_assignments(index), filters_chain))
+
+        bound = count_schedules(index, compile_filters(catalog, filters_chain)["domains"])
+        matched, exact = count_matching(index, catalog, filters_chain, bound)
+        assert exact
+        assert matched == expected
+
+
+@pytest.mark.parametrize("filters_chain", FILTER_CHAINS)
+def test_sample_draws_every_match_once(random_session, all_assignments, filters_chain):
+    for seed in range(10):
+        index, catalog = random_session(seed, 5, 4)
+        expected = _matching(catalog, all_assignments(index), filters_chain)
+
+        found, draws, exhausted = sample_schedules(
+            index, catalog, filters_chain, seed, limit=10 ** 6, max_draws=10 ** 6
+        )
+        assert exhausted
+        assert len(found) == len(set(found))
+        assert sorted(found) == sorted(expected)
+
+
+def test_sample_pages_continue_one_sequence(random_session):
+    index, catalog = random_session(3, 5, 4)
+    whole, _, _ = sample_schedules(index, catalog, [{"exclude_days": ["среда"]}], 7, limit=12)
+
+    pages = []
+    draws = 0
+    while len(pages) < len(whole):
+        page, draws, _ = sample_schedules(index, catalog, [{"exclude_days": ["среда"]}], 7, limit=3, draws=draws)
+        if not page:
+            break
+        pages += page
+    assert pages == whole
@@ -72,6 +72,16 @@ def cleanup_user_session(user_id):
         shutil.rmtree(session_dir)
 
 
+def remove_subject_file(user_id, subject_name):
+    """Удаляет загруженный файл предмета; False — если такого файла нет"""
+    input_dir = f"{SESSIONS_DIR}/{user_id}/input_schedules"
+    file_path = os.path.join(input_dir, f"{os.path.basename(subject_name)}.json")
+    if not os.path.isfile(file_path):
+        return False
+    os.remove(file_path)
+    return True
+
+
 def normalize_day_name(day):
     """Нормализует название дня недели"""
     days_map = {
@@ -87,27 +97,17 @@ def normalize_day_name(day):
     return days_map.get(day, day)
 
 
-def parse_time(time_str):
-    """Парсит строку времени в формате 'HH:MM–HH:MM'"""
-    try:
-        # Ищем время в строке
-        match = re.search(r'(\d{1,2}):(\d{2})[–-](\d{1,2}):(\d{2})', time_str)
-        if match:
-            start_hour = int(match.group(1))
-            start_min = int(match.group(2))
-            end_hour = int(match.group(3))
-            end_min = int(match.group(4))
-            return (start_hour, start_min), (end_hour, end_min)
-
-        # Альтернативный формат без минут
-        match = re.search(r'(\d{1,2})[–-](\d{1,2})', time_str)
-        if match:
-            start_hour = int(match.group(1))
-            end_hour = int(match.group(2))
-            return (start_hour, 0), (end_hour, 0)
-
-        logger.warning(f"Не удалось распарсить время: {time_str}")
-        return None
-    except Exception as e:
-        logger.error(f"Ошибка парсинга времени: {e}")
-        return None
\ No newline at end of file
+def normalize_name(name: str) -> str:
+    """Нормализует название предмета для сравнения"""
+    if not name:
+        return ""
+    # Приводим к нижнему регистру, удаляем пробелы, заменяем разделители
+    return name.strip().lower().replace(" ", "").replace("_", "").replace("-", "")
+
+
+def normalize_group(group: str) -> str:
+    """Нормализует название группы для сравнения"""
+    if not group:
+        return ""
+    # Приводим к верхнему регистру, удаляем пробелы
+    return group.strip().upper().replace(" ", "")
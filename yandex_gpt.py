@@ -0,0 +1,94 @@
+import asyncio
+import logging
+import random
+
+import httpx
+
+from config import (
+    YANDEX_GPT_API_KEY, YANDEX_GPT_URL, YANDEX_GPT_TIMEOUT,
+    YANDEX_GPT_MAX_CONCURRENCY, YANDEX_GPT_RETRIES
+)
+
+logger = logging.getLogger(__name__)
+
+# Коды ответа, после которых запрос имеет смысл повторить
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class YandexGPTClient:
+    """Асинхронный клиент Yandex GPT с общим пулом соединений.
+
+    Одновременно выполняется не больше max_concurrency запросов, неудачные
+    попытки повторяются с экспоненциальной задержкой, а все попытки одного
+    вызова укладываются в общий бюджет времени timeout.
+    """
+
+    def __init__(self, max_concurrency=YANDEX_GPT_MAX_CONCURRENCY,
+                 timeout=YANDEX_GPT_TIMEOUT, retries=YANDEX_GPT_RETRIES):
+        self._max_concurrency = max_concurrency
+        self._timeout = timeout
+        self._retries = retries
+        self._http = None
+        self._semaphore = None
+
+    def _session(self):
+        # Создаётся лениво, внутри работающего цикла событий
+        if self._http is None:
+            self._http = httpx.AsyncClient(
+                headers={
+                    "Authorization": f"Api-Key {YANDEX_GPT_API_KEY}",
+                    "Content-Type": "application/json"
+                },
+                limits=httpx.Limits(
+                    max_connections=self._max_concurrency,
+                    max_keepalive_connections=self._max_concurrency
+                )
+            )
+            self._semaphore = asyncio.Semaphore(self._max_concurrency)
+        return self._http
+
+    async def complete(self, payload):
+        """Отправляет запрос completion и возвращает разобранный JSON ответа"""
+        http = self._session()
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self._timeout
+        attempt = 0
+
+        async with self._semaphore:
+            while True:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    raise TimeoutError("Исчерпан бюджет времени запроса к Yandex GPT")
+                try:
+                    response = await http.post(YANDEX_GPT_URL, json=payload, timeout=remaining)
+                    if response.status_code not in RETRY_STATUSES:
+                        response.raise_for_status()
+                        return response.json()
+                    error = httpx.HTTPStatusError(
+                        f"Yandex GPT ответил {response.status_code}",
+                        request=response.request, response=response
+                    )
+                except (httpx.TimeoutException, httpx.NetworkError, httpx.RemoteProtocolError) as e:
+                    error = e
+
+                attempt += 1
+                delay = 0.5 * 2 ** (attempt - 1) * (1 + random.random())
+                if attempt > self._retries or loop.time() + delay >= deadline:
+                    raise error
+                logger.warning(f"Повтор запроса к Yandex GPT через {delay:.1f} с: {error}")
+                await asyncio.sleep(delay)
+
+    async def close(self):
+        """Закрывает пул соединений"""
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+            self._semaphore = None
+
+
+_client = YandexGPTClient()
+
+
+def get_client():
+    """Общий для всего процесса клиент Yandex GPT"""
+    return _client